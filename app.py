@@ -1,45 +1,62 @@
-from flask import Flask, request, jsonify, session, redirect, url_for, render_template, flash, make_response, send_from_directory
+from flask import Flask, request, jsonify, session, redirect, url_for, render_template, flash, make_response, send_from_directory, g, Response, stream_with_context, has_request_context, abort
 from functools import wraps
+import click
 import sqlite3
 import os
 import datetime
 import hashlib
+import hmac
 import time
 from werkzeug.utils import secure_filename
 import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
 import csv
+import json
+import gzip
+import mimetypes
+import shutil
+import subprocess
+import sys
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from io import StringIO
+from urllib.parse import urlencode
 from datetime import timedelta
+from markupsafe import Markup
+
+# Pillow нужен только для сборки вариантов изображений (flask build-images)
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# brotli необязателен: без него используется только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # ============ ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ============
 
-def cleanup_locks():
-    """Очистка блокировок БД при завершении"""
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        data_dir = os.path.join(base_dir, "data")
-        
-        if os.path.exists(data_dir):
-            db_path = os.path.join(data_dir, "hotel.db")
-            lock_files = [
-                db_path + '-wal', 
-                db_path + '-shm', 
-                db_path + '-journal',
-                db_path + '.wal',
-                db_path + '.shm',
-                db_path + '.journal'
-            ]
-            for lock_file in lock_files:
-                if os.path.exists(lock_file):
-                    try:
-                        os.remove(lock_file)
-                        print(f"🗑️ Удален файл блокировки: {lock_file}")
-                    except:
-                        pass
-    except Exception as e:
-        print(f"⚠️ Ошибка при очистке блокировок: {e}")
+def checkpoint_db():
+    """Перенос содержимого WAL в основной файл БД.
 
-atexit.register(cleanup_locks)
+    Файлы -wal/-shm удалять нельзя: в WAL лежат подтвержденные транзакции,
+    а другие процессы могут держать БД открытой. При закрытии последнего
+    соединения SQLite сам переносит WAL и удаляет эти файлы.
+    """
+    conn = db_pool.acquire()
+    try:
+        busy, log_pages, moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return {"busy": bool(busy), "log_pages": log_pages, "checkpointed": moved}
+    finally:
+        db_pool.release(conn)
 
 def create_missing_images():
     """Создание недостающих изображений"""
@@ -66,6 +83,284 @@ app = Flask(__name__, template_folder='templates', static_folder='static')
 app.secret_key = 'your-secret-key-here-change-this-in-production'
 app.config['UPLOAD_FOLDER'] = 'static/images'
 
+# ============ ЛОГИРОВАНИЕ ============
+
+# Уровень задается переменной окружения; по умолчанию DEBUG-сообщения отключены
+LOG_LEVEL = os.environ.get("HOTEL_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+
+logger = logging.getLogger("hotel")
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет в запись идентификатор текущего запроса"""
+
+    def filter(self, record):
+        try:
+            record.request_id = g.get("request_id", "-")
+        except RuntimeError:
+            # Вне контекста приложения (CLI, фоновые потоки)
+            record.request_id = "-"
+        return True
+
+
+def setup_logging():
+    """Запись в лог через очередь: запрос не ждет вывода в поток/файл"""
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Фильтр на обработчике очереди, чтобы request_id брался в потоке запроса
+    queue_handler.addFilter(RequestIdFilter())
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler,
+                                              respect_handler_level=True)
+
+    logger.handlers.clear()
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    listener.start()
+    # При остановке дописываем все накопленные записи
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
+
+
+@app.before_request
+def assign_request_id():
+    """Идентификатор запроса: из заголовка X-Request-ID или новый"""
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+
+
+@app.after_request
+def echo_request_id(response):
+    request_id = g.get("request_id")
+    if request_id:
+        response.headers["X-Request-ID"] = request_id
+    return response
+
+# ============ МЕТРИКИ ============
+
+# Границы корзин гистограмм (секунды и число запросов к БД)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Кумулятивная гистограмма в духе Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            result.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        result.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.total}')
+        result.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        result.append(f'{name}_count{{{labels}}} {self.total}')
+        return result
+
+
+class RequestMetrics:
+    """Метрики по маршрутам: время ответа, число и время SQL-запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.sql_per_request = {}
+        self.requests = {}
+        self.sql_queries = {}
+        self.sql_time = {}
+
+    def observe(self, endpoint, method, status, duration, sql_count, sql_time):
+        with self._lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.sql_per_request[endpoint] = Histogram(SQL_COUNT_BUCKETS)
+            self.latency[endpoint].observe(duration)
+            self.sql_per_request[endpoint].observe(sql_count)
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.sql_queries[endpoint] = self.sql_queries.get(endpoint, 0) + sql_count
+            self.sql_time[endpoint] = self.sql_time.get(endpoint, 0.0) + sql_time
+
+    def render(self, pool_stats=None):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        with self._lock:
+            lines.append("# HELP hotel_http_requests_total Обработано HTTP-запросов")
+            lines.append("# TYPE hotel_http_requests_total counter")
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'hotel_http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                             f'status="{status}"}} {count}')
+
+            lines.append("# HELP hotel_http_request_duration_seconds Время обработки запроса")
+            lines.append("# TYPE hotel_http_request_duration_seconds histogram")
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines("hotel_http_request_duration_seconds",
+                                             f'endpoint="{endpoint}"'))
+
+            lines.append("# HELP hotel_sql_queries_per_request Число SQL-запросов за один HTTP-запрос")
+            lines.append("# TYPE hotel_sql_queries_per_request histogram")
+            for endpoint, histogram in sorted(self.sql_per_request.items()):
+                lines.extend(histogram.lines("hotel_sql_queries_per_request",
+                                             f'endpoint="{endpoint}"'))
+
+            lines.append("# HELP hotel_sql_queries_total Выполнено SQL-запросов")
+            lines.append("# TYPE hotel_sql_queries_total counter")
+            for endpoint, count in sorted(self.sql_queries.items()):
+                lines.append(f'hotel_sql_queries_total{{endpoint="{endpoint}"}} {count}')
+
+            lines.append("# HELP hotel_sql_query_seconds_total Суммарное время SQL-запросов")
+            lines.append("# TYPE hotel_sql_query_seconds_total counter")
+            for endpoint, total in sorted(self.sql_time.items()):
+                lines.append(f'hotel_sql_query_seconds_total{{endpoint="{endpoint}"}} {total:.6f}')
+
+        if pool_stats:
+            for key, kind in (("open", "gauge"), ("idle", "gauge"), ("hits", "counter"),
+                              ("misses", "counter"), ("waits", "counter")):
+                lines.append(f"# TYPE hotel_db_pool_{key} {kind}")
+                lines.append(f"hotel_db_pool_{key} {pool_stats[key]}")
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+# Порог медленного запроса (мс) и число хранимых записей журнала
+SLOW_QUERY_MS = float(os.environ.get("HOTEL_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = 500
+# Значения параметров в журнале (ПДн гостей, паспорта, телефоны) по умолчанию скрыты;
+# HOTEL_SLOW_QUERY_PARAMS=1 показывает их - только для локальной отладки
+SLOW_QUERY_SHOW_PARAMS = os.environ.get("HOTEL_SLOW_QUERY_PARAMS", "0") == "1"
+PARAM_MASK = "***"
+EXPLAINABLE_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class SlowQueryLog:
+    """Журнал медленных запросов (последние SLOW_QUERY_LOG_SIZE записей)"""
+
+    def __init__(self, size=SLOW_QUERY_LOG_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self, endpoint=None, min_ms=0.0, full_scan=None, limit=100):
+        """Записи от новых к старым с фильтрами по маршруту, длительности и плану"""
+        with self._lock:
+            entries = list(self._entries)
+        result = []
+        for entry in reversed(entries):
+            if endpoint and entry["endpoint"] != endpoint:
+                continue
+            if entry["duration_ms"] < min_ms:
+                continue
+            if full_scan is not None and entry["full_scan"] != full_scan:
+                continue
+            result.append(entry)
+            if len(result) >= limit:
+                break
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog()
+
+
+def explain_plan(conn, sql, params):
+    """EXPLAIN QUERY PLAN запроса (пустой список, если план получить нельзя)"""
+    if params is None or not sql.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+        return []
+    # Обычный курсор: EXPLAIN не должен попадать в метрики и журнал
+    cur = conn.cursor(sqlite3.Cursor)
+    try:
+        cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[3] for row in cur.fetchall()]
+    except sqlite3.Error:
+        return []
+    finally:
+        cur.close()
+
+
+def log_slow_query(conn, sql, params, duration):
+    """Запись медленного запроса: SQL, длительность, маршрут и план.
+
+    Значения параметров маскируются, в журнал попадает только их количество.
+    """
+    plan = explain_plan(conn, sql, params)
+    show = SLOW_QUERY_SHOW_PARAMS and "password" not in sql.lower()
+    if params is None:
+        shown_params = None
+    elif isinstance(params, dict):
+        shown_params = {key: value if show else PARAM_MASK for key, value in params.items()}
+    else:
+        shown_params = [value if show else PARAM_MASK for value in params]
+    endpoint = (request.endpoint or "unmatched") if has_request_context() else "-"
+    entry = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "endpoint": endpoint,
+        "request_id": g.get("request_id", "-") if has_request_context() else "-",
+        "duration_ms": round(duration * 1000, 3),
+        "sql": " ".join(sql.split()),
+        "params": shown_params,
+        "plan": plan,
+        "full_scan": any(step.startswith("SCAN ") for step in plan),
+    }
+    slow_query_log.add(entry)
+    logger.warning("Медленный запрос %.1f мс (%s): %s | план: %s",
+                   entry["duration_ms"], endpoint, entry["sql"], "; ".join(plan) or "-")
+
+
+def record_query(conn, sql, params, duration):
+    """Учет SQL-запроса в текущем HTTP-запросе (вызывается из TimedCursor)"""
+    if duration * 1000 >= SLOW_QUERY_MS:
+        log_slow_query(conn, sql, params, duration)
+    if not has_request_context():
+        return
+    g.sql_count = g.get("sql_count", 0) + 1
+    g.sql_time = g.get("sql_time", 0.0) + duration
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        request_metrics.observe(
+            request.endpoint or "unmatched",
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+            g.get("sql_count", 0),
+            g.get("sql_time", 0.0),
+        )
+    return response
+
 # ============ РЕДИРЕКТЫ ДЛЯ СТАРЫХ ССЫЛОК ============
 
 @app.before_request
@@ -97,134 +392,2345 @@ def fix_old_urls():
 def favicon():
     return send_from_directory('static', 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+DB_PATH = os.path.join(DATA_DIR, "hotel.db")
+
+# Настройки пула соединений
+DB_POOL_SIZE = 8
+DB_POOL_TIMEOUT = 30
+# Ожидание блокировки записи внутри SQLite (секунды) для обычных запросов
+DB_BUSY_TIMEOUT = 30
+# Короткое ожидание для BEGIN IMMEDIATE в begin_immediate (мс); дальше - повтор с паузой
+WRITE_BUSY_TIMEOUT_MS = 200
+DB_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время каждого запроса"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(self.connection, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Для пакетного запроса план не строим: параметры уже израсходованы
+            record_query(self.connection, sql, None, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, у которого cursor() и execute() идут через TimedCursor"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+class ConnectionPool:
+    """Пул соединений SQLite, общий для всего приложения.
+
+    Соединение открывается один раз (с PRAGMA) и выдается потоку на время
+    контекста приложения, после чего возвращается в пул.
+    """
+
+    def __init__(self, db_path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._opened = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                               factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Взять соединение из пула (или открыть новое, если пул не заполнен)"""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+                self.misses += 1
+
+        if can_open:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+            with self._lock:
+                self._all.append(conn)
+            return conn
+
+        # Все соединения заняты - ждем освобождения
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Нет свободных соединений с БД в пуле")
+        finally:
+            with self._lock:
+                self.waits += 1
+                self.wait_time += time.perf_counter() - start
+        return conn
+
+    def release(self, conn):
+        """Вернуть соединение в пул, откатив незавершенную транзакцию"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+                self._opened -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """Закрыть все соединения пула (при завершении работы)"""
+        with self._lock:
+            conns = self._all
+            self._all = []
+            self._opened = 0
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        """Счетчики пула: попадания, промахи и ожидание соединения"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time_ms": round(self.wait_time * 1000, 3),
+            }
+
+
+db_pool = ConnectionPool(DB_PATH)
+atexit.register(db_pool.close_all)
+
 def get_db():
-    """Подключение к базе данных"""
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(base_dir, "data")
+    """Подключение к базе данных (одно соединение из пула на контекст приложения)"""
+    if "db" not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Возврат соединения в пул по завершении запроса"""
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.release(conn)
+
+def migration_base_schema(cur):
+    """Версия 1: таблицы, индексы, триггеры и начальные данные.
+
+    Все операторы идемпотентны (IF NOT EXISTS), поэтому миграция
+    безопасно применяется и к БД, созданной до появления версий схемы.
+    """
+    # Таблица гостей
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS guests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            full_name VARCHAR(100),
+            phone VARCHAR(20),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_login DATETIME
+        )
+    ''')
     
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+    # Таблица администраторов
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            email VARCHAR(255),
+            full_name VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Таблица типов номеров
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS room_types (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(50) NOT NULL,
+            description TEXT,
+            price_per_night DECIMAL(10,2),
+            capacity INTEGER,
+            amenities TEXT
+        )
+    ''')
+    
+    # Таблица бронирований
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guest_id INTEGER NOT NULL,
+            room_type_id INTEGER,
+            full_name VARCHAR(100) NOT NULL,
+            passport VARCHAR(50),
+            phone VARCHAR(20),
+            check_in_date DATE,
+            check_out_date DATE,
+            status VARCHAR(20) DEFAULT 'pending',
+            total_price DECIMAL(10,2),
+            nights INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (guest_id) REFERENCES guests(id),
+            FOREIGN KEY (room_type_id) REFERENCES room_types(id)
+        )
+    ''')
+    
+    # Количество ночей хранится в самой заявке (для старых БД - добавляем)
+    cur.execute("PRAGMA table_info(bookings)")
+    if "nights" not in [col["name"] for col in cur.fetchall()]:
+        cur.execute("ALTER TABLE bookings ADD COLUMN nights INTEGER")
+    cur.execute('''
+        UPDATE bookings
+        SET nights = CAST(julianday(check_out_date) - julianday(check_in_date) AS INTEGER)
+        WHERE nights IS NULL
+    ''')
+    # Заявки, созданные в обход приложения, получают nights триггером
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_nights_insert
+        AFTER INSERT ON bookings
+        WHEN NEW.nights IS NULL
+        BEGIN
+            UPDATE bookings
+            SET nights = CAST(julianday(NEW.check_out_date) - julianday(NEW.check_in_date) AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_nights_update
+        AFTER UPDATE OF check_in_date, check_out_date ON bookings
+        BEGIN
+            UPDATE bookings
+            SET nights = CAST(julianday(NEW.check_out_date) - julianday(NEW.check_in_date) AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    ''')
+    
+    # Таблица отзывов
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guest_id INTEGER NOT NULL,
+            rating INTEGER CHECK(rating BETWEEN 1 AND 5),
+            comment TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (guest_id) REFERENCES guests(id)
+        )
+    ''')
     
-    db_path = os.path.join(data_dir, "hotel.db")
+    # Индекс для списка последних гостей в панели администратора
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_guests_created ON guests (created_at)")
     
-    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Индексы для постраничного вывода (ключ страницы - created_at, id)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reviews_created ON reviews (created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_guest_created ON bookings (guest_id, created_at, id)")
+    
+    # Индексы для проверки доступности номеров.
+    # Пересечение периодов проверяется одним условием
+    # check_in_date < :выезд AND check_out_date > :заезд, а дата выезда
+    # идет в индексе первой после статуса: запрашиваемые даты всегда в
+    # будущем, поэтому диапазон по check_out_date отсекает всю историю.
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_availability
+        ON bookings (room_type_id, status, check_out_date, check_in_date)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_guest_dates
+        ON bookings (guest_id, status, check_out_date, check_in_date)
+    ''')
+    
+    # Индекс для отчетов по дате создания заявки
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_created
+        ON bookings (created_at, status)
+    ''')
+    
+    # Календарь занятости: по строке на каждый занятый день бронирования
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS room_day_occupancy (
+            room_type_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            booking_id INTEGER NOT NULL,
+            PRIMARY KEY (room_type_id, day, booking_id),
+            FOREIGN KEY (room_type_id) REFERENCES room_types(id),
+            FOREIGN KEY (booking_id) REFERENCES bookings(id)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_occupancy_day ON room_day_occupancy (day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_occupancy_booking ON room_day_occupancy (booking_id)")
+    create_occupancy_triggers(cur)
+    
+    cur.execute("SELECT EXISTS (SELECT 1 FROM room_day_occupancy)")
+    if not cur.fetchone()[0]:
+        rebuild_occupancy(cur)
+    
+    # Сводная статистика отзывов (одна строка, ведется триггерами)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS review_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_reviews INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            five_stars INTEGER NOT NULL DEFAULT 0,
+            four_stars INTEGER NOT NULL DEFAULT 0,
+            three_stars INTEGER NOT NULL DEFAULT 0,
+            two_stars INTEGER NOT NULL DEFAULT 0,
+            one_stars INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    create_review_stats_triggers(cur)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM review_stats)")
+    if not cur.fetchone()[0]:
+        rebuild_review_stats(cur)
+    
+    # Счетчики записей по таблицам и по статусам бронирований
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS entity_counters (
+            name VARCHAR(50) PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    create_counter_triggers(cur)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM entity_counters)")
+    if not cur.fetchone()[0]:
+        rebuild_counters(cur)
+    
+    # Версии кэшируемых справочников (для сверки кэша между процессами)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name VARCHAR(50) PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cur.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('room_types', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_room_types_version_{event.lower()}
+            AFTER {event} ON room_types
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'room_types';
+            END
+        ''')
+    
+    # Добавляем тестовые данные
+    cur.execute("SELECT COUNT(*) FROM admins WHERE username = 'admin'")
+    if cur.fetchone()[0] == 0:
+        cur.execute(
+            "INSERT INTO admins (username, password_hash, email, full_name) VALUES (?, ?, ?, ?)",
+            ('admin', hash_password('admin123'), 'admin@hotel.com', 'Главный администратор')
+        )
+        print("✅ Создан администратор: admin / admin123")
+    
+    cur.execute("SELECT COUNT(*) FROM room_types")
+    if cur.fetchone()[0] == 0:
+        room_types = [
+            ('Экономный', 'Бюджетный номер с базовыми удобствами', 1500.00, 1, 'Wi-Fi, душ, телевизор'),
+            ('Стандартный', 'Комфортабельный номер для 2-х человек', 2500.00, 2, 'Wi-Fi, кондиционер, мини-бар'),
+            ('Люксовый', 'Просторный номер с улучшенным сервисом', 5000.00, 2, 'Wi-Fi, джакузи, персональный дворецкий')
+        ]
+        cur.executemany(
+            "INSERT INTO room_types (name, description, price_per_night, capacity, amenities) VALUES (?, ?, ?, ?, ?)",
+            room_types
+        )
+        print("✅ Созданы типы номеров")
+
+
+def migration_review_stats_null_rating(cur):
+    """Версия 2: триггеры review_stats принимают отзывы без оценки (rating IS NULL)"""
+    for trigger in ("trg_reviews_stats_insert", "trg_reviews_stats_delete", "trg_reviews_stats_update"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    create_review_stats_triggers(cur)
+
+
+# Миграции схемы: (версия, описание, функция). Новые - только в конец списка
+SCHEMA_MIGRATIONS = (
+    (1, "Базовая схема", migration_base_schema),
+    (2, "Отзывы без оценки в review_stats", migration_review_stats_null_rating),
+)
+
+
+def schema_version(conn):
+    """Примененная версия схемы (PRAGMA user_version)"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_db():
+    """Применить недостающие миграции; возвращает число примененных.
+
+    Если версия схемы актуальна, выполняется только чтение PRAGMA user_version -
+    никаких DDL при старте процесса.
+    """
+    target = SCHEMA_MIGRATIONS[-1][0]
+    conn = db_pool.acquire()
+    try:
+        if schema_version(conn) >= target:
+            return 0
+        # Несколько процессов могут стартовать одновременно: версию
+        # перечитываем уже под блокировкой записи
+        begin_immediate(conn)
+        try:
+            current = schema_version(conn)
+            applied = 0
+            for version, title, migration in SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                logger.info("Миграция схемы %d применена: %s", version, title)
+                applied += 1
+            conn.commit()
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        db_pool.release(conn)
+
+
+def init_db():
+    """Создание/обновление базы данных (для запуска из консоли)"""
+    print("🔄 Инициализация базы данных...")
+    try:
+        applied = migrate_db()
+        if applied:
+            print(f"✅ База данных обновлена до версии {SCHEMA_MIGRATIONS[-1][0]} (миграций: {applied})")
+        else:
+            print("✅ Схема базы данных актуальна")
+    except Exception as e:
+        print(f"❌ Ошибка при инициализации БД: {e}")
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Применить миграции схемы БД"""
+    init_db()
+
+# ============ ДОСТУПНОСТЬ НОМЕРОВ ============
+
+def availability(check_in, check_out, min_capacity=0):
+    """Занятость всех типов номеров на период одним запросом.
+
+    Возвращает список словарей (по возрастанию цены) с полями типа номера,
+    флагом occupied, числом конфликтующих бронирований, занятыми периодами
+    и логинами гостей, которые их забронировали.
+    """
+    cur = get_db().cursor()
+    cur.execute('''
+        SELECT rt.id, rt.name, rt.price_per_night, rt.capacity,
+               COUNT(b.id) AS conflict_count,
+               GROUP_CONCAT(DISTINCT b.check_in_date || ' - ' || b.check_out_date) AS dates,
+               GROUP_CONCAT(DISTINCT g.username) AS users
+        FROM room_types rt
+        LEFT JOIN bookings b ON b.room_type_id = rt.id
+            AND b.status IN ('pending', 'confirmed')
+            AND b.check_in_date < ? AND b.check_out_date > ?
+        LEFT JOIN guests g ON g.id = b.guest_id
+        WHERE rt.capacity >= ?
+        GROUP BY rt.id
+        ORDER BY rt.price_per_night
+    ''', (check_out, check_in, min_capacity))
+    
+    rooms = []
+    for row in cur.fetchall():
+        rooms.append({
+            "id": row["id"],
+            "name": row["name"],
+            "price_per_night": row["price_per_night"],
+            "capacity": row["capacity"],
+            "occupied": row["conflict_count"] > 0,
+            "conflict_count": row["conflict_count"],
+            "conflict_dates": row["dates"].split(',') if row["dates"] else [],
+            "conflict_users": row["users"].split(',') if row["users"] else [],
+        })
+    return rooms
+
+# Повторы BEGIN IMMEDIATE при занятой блокировке записи
+WRITE_RETRIES = 5
+WRITE_BACKOFF = 0.02
+
+# Вставка выполняется, только если номер и гость свободны на эти даты
+RESERVE_BOOKING_SQL = '''
+    INSERT INTO bookings (guest_id, room_type_id, full_name, passport, phone,
+                          check_in_date, check_out_date, total_price, nights, status)
+    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending'
+    WHERE NOT EXISTS (
+        SELECT 1 FROM bookings
+        WHERE room_type_id = ?
+        AND status IN ('pending', 'confirmed')
+        AND check_in_date < ? AND check_out_date > ?
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM bookings
+        WHERE guest_id = ?
+        AND status IN ('pending', 'confirmed')
+        AND check_in_date < ? AND check_out_date > ?
+    )
+'''
+
+
+def is_busy_error(error):
+    """Временная ошибка блокировки БД: запрос имеет смысл повторить"""
+    return (isinstance(error, sqlite3.OperationalError)
+            and ("locked" in str(error) or "busy" in str(error)))
+
+
+def begin_immediate(conn, retries=WRITE_RETRIES, backoff=WRITE_BACKOFF):
+    """BEGIN IMMEDIATE с повтором и экспоненциальной паузой при занятой БД.
+
+    Короткий busy_timeout действует только на время захвата блокировки,
+    остальные запросы соединения ждут обычные DB_BUSY_TIMEOUT секунд.
+    """
+    conn.execute(f"PRAGMA busy_timeout = {WRITE_BUSY_TIMEOUT_MS}")
+    try:
+        for attempt in range(retries):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                if attempt == retries - 1:
+                    raise
+                delay = backoff * (2 ** attempt)
+                logger.debug("БД занята, повтор через %.3f с (попытка %d)", delay, attempt + 1)
+                time.sleep(delay + random.uniform(0, delay))
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT * 1000}")
+
+
+def reserve_booking(conn, guest_id, room_type_id, full_name, passport, phone,
+                    check_in, check_out, total_price, nights):
+    """Атомарное создание бронирования.
+
+    Проверка пересечений и вставка - один оператор внутри BEGIN IMMEDIATE,
+    поэтому два одновременных запроса не могут занять один номер.
+    Возвращает id бронирования или None, если даты уже заняты.
+    """
+    begin_immediate(conn)
+    try:
+        cur = conn.execute(RESERVE_BOOKING_SQL, (
+            guest_id, room_type_id, full_name, passport, phone,
+            check_in, check_out, total_price, nights,
+            room_type_id, check_out, check_in,
+            guest_id, check_out, check_in,
+        ))
+        if cur.rowcount == 0:
+            conn.rollback()
+            return None
+        booking_id = cur.lastrowid
+        conn.commit()
+        return booking_id
+    except Exception:
+        conn.rollback()
+        raise
+
+# ============ КАЛЕНДАРЬ ЗАНЯТОСТИ ============
+
+# Дни бронирования [check_in_date; check_out_date) для строки NEW
+OCCUPANCY_DAYS_SQL = '''
+    INSERT OR IGNORE INTO room_day_occupancy (room_type_id, day, booking_id)
+    WITH RECURSIVE days(day) AS (
+        SELECT NEW.check_in_date
+        UNION ALL
+        SELECT DATE(day, '+1 day') FROM days
+        WHERE DATE(day, '+1 day') < NEW.check_out_date
+    )
+    SELECT NEW.room_type_id, day, NEW.id FROM days
+    WHERE NEW.status IN ('pending', 'confirmed')
+    AND NEW.room_type_id IS NOT NULL
+    AND NEW.check_in_date < NEW.check_out_date;
+'''
+
+def create_occupancy_triggers(cur):
+    """Триггеры, поддерживающие room_day_occupancy при изменении bookings"""
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_occupancy_insert
+        AFTER INSERT ON bookings
+        BEGIN
+            {OCCUPANCY_DAYS_SQL}
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_occupancy_update
+        AFTER UPDATE OF status, room_type_id, check_in_date, check_out_date ON bookings
+        BEGIN
+            DELETE FROM room_day_occupancy WHERE booking_id = OLD.id;
+            {OCCUPANCY_DAYS_SQL}
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_occupancy_delete
+        AFTER DELETE ON bookings
+        BEGIN
+            DELETE FROM room_day_occupancy WHERE booking_id = OLD.id;
+        END
+    ''')
+
+def rebuild_occupancy(cur):
+    """Полная пересборка календаря занятости из таблицы bookings"""
+    cur.execute("DELETE FROM room_day_occupancy")
+    cur.execute('''
+        INSERT INTO room_day_occupancy (room_type_id, day, booking_id)
+        WITH RECURSIVE days(booking_id, room_type_id, day, check_out_date) AS (
+            SELECT id, room_type_id, check_in_date, check_out_date
+            FROM bookings
+            WHERE status IN ('pending', 'confirmed')
+            AND room_type_id IS NOT NULL
+            AND check_in_date < check_out_date
+            UNION ALL
+            SELECT booking_id, room_type_id, DATE(day, '+1 day'), check_out_date
+            FROM days
+            WHERE DATE(day, '+1 day') < check_out_date
+        )
+        SELECT room_type_id, day, booking_id FROM days
+    ''')
+    return cur.rowcount
+
+@app.cli.command("rebuild-occupancy")
+def rebuild_occupancy_command():
+    """Пересобрать календарь занятости номеров (room_day_occupancy)"""
+    conn = db_pool.acquire()
+    try:
+        count = rebuild_occupancy(conn.cursor())
+        conn.commit()
+        print(f"✅ Календарь занятости пересобран: {count} записей")
+    finally:
+        db_pool.release(conn)
+
+# ============ СТАТИСТИКА ОТЗЫВОВ ============
+
+def _review_stats_delta(row, sign):
+    """SET-часть UPDATE review_stats для строки отзыва NEW/OLD"""
+    return f'''
+        total_reviews = total_reviews {sign} 1,
+        rating_sum = rating_sum {sign} COALESCE({row}.rating, 0),
+        five_stars = five_stars {sign} COALESCE({row}.rating = 5, 0),
+        four_stars = four_stars {sign} COALESCE({row}.rating = 4, 0),
+        three_stars = three_stars {sign} COALESCE({row}.rating = 3, 0),
+        two_stars = two_stars {sign} COALESCE({row}.rating = 2, 0),
+        one_stars = one_stars {sign} COALESCE({row}.rating = 1, 0)
+    '''
+
+def create_review_stats_triggers(cur):
+    """Триггеры, обновляющие review_stats в той же транзакции, что и отзыв"""
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_stats_insert
+        AFTER INSERT ON reviews
+        BEGIN
+            UPDATE review_stats SET {_review_stats_delta("NEW", "+")} WHERE id = 1;
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_stats_delete
+        AFTER DELETE ON reviews
+        BEGIN
+            UPDATE review_stats SET {_review_stats_delta("OLD", "-")} WHERE id = 1;
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_stats_update
+        AFTER UPDATE OF rating ON reviews
+        BEGIN
+            UPDATE review_stats SET {_review_stats_delta("OLD", "-")} WHERE id = 1;
+            UPDATE review_stats SET {_review_stats_delta("NEW", "+")} WHERE id = 1;
+        END
+    ''')
+
+def rebuild_review_stats(cur):
+    """Пересчитать review_stats по всей таблице reviews"""
+    cur.execute('''
+        INSERT OR REPLACE INTO review_stats
+            (id, total_reviews, rating_sum, five_stars, four_stars, three_stars, two_stars, one_stars)
+        SELECT 1,
+               COUNT(*),
+               COALESCE(SUM(rating), 0),
+               COUNT(CASE WHEN rating = 5 THEN 1 END),
+               COUNT(CASE WHEN rating = 4 THEN 1 END),
+               COUNT(CASE WHEN rating = 3 THEN 1 END),
+               COUNT(CASE WHEN rating = 2 THEN 1 END),
+               COUNT(CASE WHEN rating = 1 THEN 1 END)
+        FROM reviews
+    ''')
+
+# ============ КЭШ СПРАВОЧНИКА НОМЕРОВ ============
+
+# Как часто (в секундах) сверять версию справочника с БД; None - только по invalidate()
+ROOM_CATALOG_TTL = 60
+
+
+class RoomCatalog:
+    """Кэш таблицы room_types в памяти процесса.
+
+    Справочник читается из БД один раз и отдается из памяти. Раз в ttl секунд
+    кэш сверяет свою версию с cache_versions (ее увеличивают триггеры на
+    room_types), так что изменения из другого процесса тоже будут замечены.
+    """
+
+    def __init__(self, ttl=ROOM_CATALOG_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rooms = None
+        self._version = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    def _db_version(self, conn):
+        row = conn.execute("SELECT version FROM cache_versions WHERE name = 'room_types'").fetchone()
+        return row["version"] if row else 0
+
+    def _rooms_list(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._rooms is not None:
+                if self.ttl is None or now - self._checked_at < self.ttl:
+                    return self._rooms
+                conn = get_db()
+                if self._db_version(conn) == self._version:
+                    self._checked_at = now
+                    return self._rooms
+                changed = True
+            else:
+                conn = get_db()
+                changed = False
+            
+            self._version = self._db_version(conn)
+            self._rooms = conn.execute("SELECT * FROM room_types ORDER BY price_per_night").fetchall()
+            self._checked_at = now
+        
+        if changed:
+            self._notify()
+        return self._rooms
+
+    def all(self):
+        """Все типы номеров по возрастанию цены"""
+        return list(self._rooms_list())
+
+    def get_by_name(self, name):
+        """Тип номера по точному названию"""
+        for room in self._rooms_list():
+            if room["name"] == name:
+                return room
+        return None
+
+    def find(self, fragment):
+        """Первый тип номера, в названии которого есть fragment"""
+        for room in self._rooms_list():
+            if fragment in room["name"]:
+                return room
+        return None
+
+    @property
+    def version(self):
+        return self._version
+
+    def on_invalidate(self, callback):
+        """Подписаться на сброс кэша (например, для кэша страниц)"""
+        self._listeners.append(callback)
+        return callback
+
+    def invalidate(self):
+        """Сбросить кэш: следующий запрос перечитает справочник из БД"""
+        with self._lock:
+            self._rooms = None
+            self._version = None
+        self._notify()
+
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+
+room_catalog = RoomCatalog()
+
+# ============ КЭШ СТРАНИЦ ============
+
+# Размер LRU-кэша страниц в памяти и время жизни записи (секунды)
+PAGE_CACHE_SIZE = 256
+PAGE_CACHE_TTL = 30
+# Предел записей в общем хранилище (файлы/SQLite); лишние и устаревшие удаляются при записи
+PAGE_CACHE_SHARED_SIZE = 2048
+# Параметры запроса, от которых зависит страница; остальные в ключ кэша не входят
+PAGE_CACHE_QUERY_ARGS = ("before",)
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+class MemoryPageStore:
+    """LRU-кэш готовых страниц в памяти процесса"""
+
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data.move_to_end(key)
+            return item
+
+    def set(self, key, item):
+        with self._lock:
+            self._data[key] = item
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete_path(self, path):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == path]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FilePageStore:
+    """Кэш страниц в файлах на диске, общий для нескольких процессов.
+
+    Поколения страниц лежат в подкаталоге _generation: invalidate() в любом
+    процессе меняет поколение, и копии в памяти других процессов устаревают.
+    """
+
+    GENERATION_DIR = "_generation"
+
+    def __init__(self, directory, max_entries=PAGE_CACHE_SHARED_SIZE):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def _file(self, key):
+        path, variant = key
+        return os.path.join(self.directory, _digest(path), _digest(variant))
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                created_at = float(f.readline())
+                mimetype = f.readline().decode().strip()
+                return (f.read(), mimetype, created_at)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, item):
+        body, mimetype, created_at = item
+        filename = self._file(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(f"{created_at}\n{mimetype}\n".encode())
+            f.write(body)
+        # prune() определяет возраст записи по mtime
+        os.utime(tmp, (created_at, created_at))
+        os.replace(tmp, filename)
+
+    def prune(self, expired_before):
+        """Удалить устаревшие записи и самые старые сверх max_entries"""
+        entries = []
+        try:
+            page_dirs = [name for name in os.listdir(self.directory) if name != self.GENERATION_DIR]
+        except OSError:
+            return
+        for page_dir in page_dirs:
+            page_path = os.path.join(self.directory, page_dir)
+            try:
+                filenames = os.listdir(page_path)
+            except OSError:
+                continue
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                entry = os.path.join(page_path, filename)
+                try:
+                    entries.append((os.stat(entry).st_mtime, entry))
+                except OSError:
+                    continue
+        entries.sort(reverse=True)
+        for index, (mtime, entry) in enumerate(entries):
+            if index >= self.max_entries or mtime < expired_before:
+                try:
+                    os.remove(entry)
+                except OSError:
+                    pass
+
+    def _generation_file(self, path):
+        return os.path.join(self.directory, self.GENERATION_DIR, _digest(path) if path else "all")
+
+    def generation(self, path):
+        """Поколение страницы: меняется при каждом invalidate() этой страницы или всего кэша"""
+        tokens = []
+        for filename in (self._generation_file(None), self._generation_file(path)):
+            try:
+                with open(filename, encoding="ascii") as f:
+                    tokens.append(f.read())
+            except OSError:
+                tokens.append("")
+        return "|".join(tokens)
+
+    def bump(self, path=None):
+        filename = self._generation_file(path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp, filename)
+
+    def delete_path(self, path):
+        shutil.rmtree(os.path.join(self.directory, _digest(path)), ignore_errors=True)
+
+    def clear(self):
+        try:
+            page_dirs = [name for name in os.listdir(self.directory) if name != self.GENERATION_DIR]
+        except OSError:
+            return
+        for page_dir in page_dirs:
+            shutil.rmtree(os.path.join(self.directory, page_dir), ignore_errors=True)
+
+
+class SqlitePageStore:
+    """Кэш страниц в отдельной БД SQLite, общий для нескольких процессов.
+
+    Таблица page_cache_generation хранит счетчики поколений: invalidate()
+    в любом процессе увеличивает счетчик, и копии в памяти других процессов устаревают.
+    """
+
+    def __init__(self, db_path, max_entries=PAGE_CACHE_SHARED_SIZE):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS page_cache (
+                    path TEXT NOT NULL,
+                    variant TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    mimetype TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (path, variant)
+                )
+            ''')
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_page_cache_created ON page_cache(created_at)"
+            )
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS page_cache_generation (
+                    path TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT body, mimetype, created_at FROM page_cache WHERE path = ? AND variant = ?", key
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, key, item):
+        with self._lock, self._db() as conn:
+            conn.execute("INSERT OR REPLACE INTO page_cache VALUES (?, ?, ?, ?, ?)", key + item)
+
+    def prune(self, expired_before):
+        """Удалить устаревшие записи и самые старые сверх max_entries"""
+        with self._lock, self._db() as conn:
+            conn.execute("DELETE FROM page_cache WHERE created_at < ?", (expired_before,))
+            conn.execute('''
+                DELETE FROM page_cache WHERE rowid IN (
+                    SELECT rowid FROM page_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def generation(self, path):
+        """Поколение страницы: меняется при каждом invalidate() этой страницы или всего кэша"""
+        with self._lock:
+            return self._db().execute(
+                "SELECT COALESCE(SUM(value), 0) FROM page_cache_generation WHERE path IN (?, '*')",
+                (path,)
+            ).fetchone()[0]
+
+    def bump(self, path=None):
+        with self._lock, self._db() as conn:
+            conn.execute('''
+                INSERT INTO page_cache_generation (path, value) VALUES (?, 1)
+                ON CONFLICT(path) DO UPDATE SET value = value + 1
+            ''', (path or "*",))
+
+    def delete_path(self, path):
+        with self._lock, self._db() as conn:
+            conn.execute("DELETE FROM page_cache WHERE path = ?", (path,))
+
+    def clear(self):
+        with self._lock, self._db() as conn:
+            conn.execute("DELETE FROM page_cache")
+
+
+class PageCache:
+    """Кэш отрендеренных страниц: LRU в памяти плюс необязательное общее хранилище.
+
+    Ключ - (путь, вариант страницы: id гостя и значимые параметры запроса). Запись
+    хранится как (тело, mimetype, время создания) и устаревает через ttl секунд.
+    С общим хранилищем копия в памяти действительна, пока не сменилось поколение
+    страницы в хранилище - так invalidate() доходит до всех процессов.
+    """
+
+    def __init__(self, size=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL, shared=None):
+        self.ttl = ttl
+        self.memory = MemoryPageStore(size)
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, item):
+        return item is not None and time.time() - item[2] < self.ttl
+
+    def _generation(self, path):
+        return self.shared.generation(path) if self.shared is not None else None
+
+    def get(self, key):
+        generation = self._generation(key[0])
+        entry = self.memory.get(key)
+        item = entry[0] if entry is not None and entry[1] == generation else None
+        if not self._fresh(item) and self.shared is not None:
+            item = self.shared.get(key)
+            if self._fresh(item):
+                self.memory.set(key, (item, generation))
+        if self._fresh(item):
+            self.hits += 1
+            return item
+        self.misses += 1
+        return None
+
+    def set(self, key, item):
+        self.memory.set(key, (item, self._generation(key[0])))
+        if self.shared is not None:
+            self.shared.set(key, item)
+            self.shared.prune(time.time() - self.ttl)
+
+    def invalidate(self, path=None):
+        """Сбросить кэш одной страницы или весь кэш (во всех процессах, если есть общее хранилище)"""
+        for store in (self.memory, self.shared):
+            if store is None:
+                continue
+            if path is None:
+                store.clear()
+            else:
+                store.delete_path(path)
+        # Поколение меняется после удаления: иначе другой процесс может
+        # успеть запомнить старую запись уже с новым поколением
+        if self.shared is not None:
+            self.shared.bump(path)
+
+
+# Для нескольких процессов: shared=FilePageStore(...) или SqlitePageStore(...)
+page_cache = PageCache()
+room_catalog.on_invalidate(page_cache.invalidate)
+
+
+def cached_page(f):
+    """Отдавать GET-страницу из кэша страниц.
+
+    Вариант страницы зависит от гостя, параметров PAGE_CACHE_QUERY_ARGS и
+    непоказанных flash-сообщений. Если страница при рендере сама вывела flash-сообщения,
+    результат в кэш не кладется.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != "GET":
+            return f(*args, **kwargs)
+        
+        flashes = session.get("_flashes")
+        flash_state = _digest(repr(flashes)) if flashes else ""
+        query = urlencode([(name, value) for name in PAGE_CACHE_QUERY_ARGS
+                           for value in request.args.getlist(name)])
+        variant = f"{session.get('guest_id', '')}|{flash_state}?{query}"
+        key = (request.path, variant)
+        item = page_cache.get(key)
+        if item is not None:
+            return Response(item[0], mimetype=item[1])
+        
+        response = make_response(f(*args, **kwargs))
+        if (response.status_code == 200 and not response.is_streamed
+                and session.get("_flashes") == flashes):
+            page_cache.set(key, (response.get_data(), response.mimetype, time.time()))
+        return response
+    return decorated_function
+
+# ============ ПОСТРАНИЧНЫЙ ВЫВОД ============
+
+# Сколько записей выводить на одной странице отзывов и истории бронирований
+PAGE_SIZE = 20
+
+def encode_cursor(row):
+    """Курсор следующей страницы по последней строке текущей"""
+    return f"{row['created_at']}|{row['id']}"
+
+def decode_cursor(value):
+    """(created_at, id) из курсора или None, если курсор не задан/испорчен"""
+    if not value:
+        return None
+    created_at, _, row_id = value.rpartition('|')
+    try:
+        return (created_at, int(row_id))
+    except ValueError:
+        return None
+
+def _keyset_page(cur, sql, params, cursor, limit):
+    """Выполнить запрос страницы, вернуть (строки, курсор следующей страницы)"""
+    # Для первой страницы граница берется выше любой даты
+    cur.execute(sql, params + (cursor or ("\uffff", 0)) + (limit + 1,))
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def fetch_reviews_page(cursor=None, limit=PAGE_SIZE):
+    """Страница отзывов от новых к старым, начиная после cursor"""
+    return _keyset_page(get_db().cursor(), '''
+        SELECT r.*, g.username 
+        FROM reviews r 
+        JOIN guests g ON r.guest_id = g.id 
+        WHERE (r.created_at, r.id) < (?, ?)
+        ORDER BY r.created_at DESC, r.id DESC
+        LIMIT ?
+    ''', (), cursor, limit)
+
+def fetch_guest_bookings_page(guest_id, cursor=None, limit=PAGE_SIZE):
+    """Страница бронирований гостя от новых к старым, начиная после cursor"""
+    return _keyset_page(get_db().cursor(), '''
+        SELECT b.*, rt.name as room_type_name, rt.price_per_night
+        FROM bookings b
+        LEFT JOIN room_types rt ON b.room_type_id = rt.id
+        WHERE b.guest_id = ?
+        AND (b.created_at, b.id) < (?, ?)
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT ?
+    ''', (guest_id,), cursor, limit)
+
+# ============ СЧЕТЧИКИ ЗАПИСЕЙ ============
+
+# Таблицы, для которых ведется общий счетчик строк в entity_counters.
+# Для bookings дополнительно ведутся счетчики 'bookings:<статус>'.
+COUNTED_TABLES = ("guests", "bookings", "reviews")
+
+def _counter_upsert(name_sql, delta):
+    return f'''
+        INSERT INTO entity_counters (name, value) VALUES ({name_sql}, {delta})
+        ON CONFLICT(name) DO UPDATE SET value = value + ({delta});
+    '''
+
+def create_counter_triggers(cur):
+    """Триггеры, поддерживающие entity_counters при изменении таблиц"""
+    for table in COUNTED_TABLES:
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_counter_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                {_counter_upsert(f"'{table}'", 1)}
+            END
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_counter_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                {_counter_upsert(f"'{table}'", -1)}
+            END
+        ''')
+    
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_status_counter_insert
+        AFTER INSERT ON bookings
+        BEGIN
+            {_counter_upsert("'bookings:' || COALESCE(NEW.status, '')", 1)}
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_status_counter_delete
+        AFTER DELETE ON bookings
+        BEGIN
+            {_counter_upsert("'bookings:' || COALESCE(OLD.status, '')", -1)}
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_status_counter_update
+        AFTER UPDATE OF status ON bookings
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            {_counter_upsert("'bookings:' || COALESCE(OLD.status, '')", -1)}
+            {_counter_upsert("'bookings:' || COALESCE(NEW.status, '')", 1)}
+        END
+    ''')
+
+def count_entities(cur):
+    """Фактические количества строк (полный пересчет по таблицам)"""
+    counts = {}
+    for table in COUNTED_TABLES:
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        counts[table] = cur.fetchone()[0]
+    cur.execute("SELECT COALESCE(status, ''), COUNT(*) FROM bookings GROUP BY status")
+    for status, count in cur.fetchall():
+        counts[f"bookings:{status}"] = count
+    return counts
+
+def rebuild_counters(cur):
+    """Пересчитать entity_counters заново по таблицам"""
+    cur.execute("DELETE FROM entity_counters")
+    cur.executemany(
+        "INSERT INTO entity_counters (name, value) VALUES (?, ?)",
+        count_entities(cur).items()
+    )
+
+def read_counters(cur, *names):
+    """Значения счетчиков по именам (отсутствующие - 0)"""
+    cur.execute(
+        f"SELECT name, value FROM entity_counters WHERE name IN ({', '.join('?' * len(names))})",
+        names
+    )
+    values = dict.fromkeys(names, 0)
+    values.update((row["name"], row["value"]) for row in cur.fetchall())
+    return values
+
+@app.cli.command("check-counters")
+@click.option("--repair", is_flag=True, help="Пересчитать счетчики при расхождении")
+def check_counters_command(repair):
+    """Сверить entity_counters с фактическим количеством строк"""
+    conn = db_pool.acquire()
+    try:
+        cur = conn.cursor()
+        actual = count_entities(cur)
+        cur.execute("SELECT name, value FROM entity_counters")
+        stored = {row["name"]: row["value"] for row in cur.fetchall()}
+        
+        mismatches = [
+            (name, stored.get(name, 0), actual.get(name, 0))
+            for name in sorted(set(actual) | set(stored))
+            if stored.get(name, 0) != actual.get(name, 0)
+        ]
+        if not mismatches:
+            print("✅ Счетчики совпадают с данными")
+            return
+        
+        for name, stored_value, actual_value in mismatches:
+            print(f"❌ {name}: в счетчике {stored_value}, на самом деле {actual_value}")
+        
+        if repair:
+            rebuild_counters(cur)
+            conn.commit()
+            print("✅ Счетчики пересчитаны")
+        else:
+            raise SystemExit(1)
+    finally:
+        db_pool.release(conn)
+
+# ============ СНИМОК ПАНЕЛИ АДМИНИСТРАТОРА ============
+
+# Сколько секунд отдавать снимок панели администратора без обращения к БД
+DASHBOARD_TTL = 5
+
+
+class DashboardSnapshot:
+    """Счетчики и последние записи для панели администратора с коротким кэшем"""
+
+    def __init__(self, ttl=DASHBOARD_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._taken_at = 0.0
+
+    def _take(self):
+        cur = get_db().cursor()
+        
+        # Все счетчики одним запросом из entity_counters
+        counters = read_counters(cur, "guests", "bookings", "bookings:pending", "reviews")
+        snapshot = {
+            "total_guests": counters["guests"],
+            "total_bookings": counters["bookings"],
+            "pending_bookings": counters["bookings:pending"],
+            "total_reviews": counters["reviews"],
+        }
+        
+        cur.execute("SELECT * FROM guests ORDER BY created_at DESC LIMIT 10")
+        snapshot["recent_guests"] = cur.fetchall()
+        
+        cur.execute('''
+            SELECT b.*, g.username, rt.name as room_type_name
+            FROM bookings b
+            JOIN guests g ON b.guest_id = g.id
+            LEFT JOIN room_types rt ON b.room_type_id = rt.id
+            ORDER BY b.created_at DESC LIMIT 10
+        ''')
+        snapshot["recent_bookings"] = cur.fetchall()
+        
+        cur.execute('''
+            SELECT r.*, g.username
+            FROM reviews r
+            JOIN guests g ON r.guest_id = g.id
+            ORDER BY r.created_at DESC LIMIT 10
+        ''')
+        snapshot["recent_reviews"] = cur.fetchall()
+        return snapshot
+
+    def get(self):
+        """Снимок панели (из кэша, если он моложе ttl секунд)"""
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or now - self._taken_at >= self.ttl:
+                self._snapshot = self._take()
+                self._taken_at = now
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+dashboard = DashboardSnapshot()
+
+# ============ ОТЛОЖЕННАЯ ЗАПИСЬ ============
+
+# Интервал сброса (секунды) и максимальный размер одной пачки
+WRITE_BEHIND_INTERVAL = 2
+WRITE_BEHIND_BATCH = 500
+
+
+class WriteBehind:
+    """Фоновая запись некритичных обновлений (last_login, аудит, аналитика).
+
+    Запросы только ставят запись в очередь. Записи с одинаковым ключом
+    схлопываются (остается последняя), поток сбрасывает их пачками в одной
+    транзакции раз в WRITE_BEHIND_INTERVAL секунд и при остановке.
+    """
+
+    def __init__(self, interval=WRITE_BEHIND_INTERVAL, batch=WRITE_BEHIND_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def submit(self, key, sql, params):
+        """Поставить запись в очередь; key - для схлопывания повторов"""
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+                del self._pending[key]
+            self._pending[key] = (sql, params)
+            self.submitted += 1
+            full = len(self._pending) >= self.batch
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def _take(self):
+        with self._lock:
+            items = []
+            while self._pending and len(items) < self.batch:
+                items.append(self._pending.popitem(last=False))
+            return items
+
+    def _requeue(self, items):
+        # Возвращаем несохраненные записи, если их не вытеснили более новые
+        with self._lock:
+            for key, value in reversed(items):
+                if key not in self._pending:
+                    self._pending[key] = value
+                    self._pending.move_to_end(key, last=False)
+
+    def flush(self):
+        """Записать все накопленное пачками; возвращает число записей.
+
+        При занятой БД или исчерпанном пуле пачка возвращается в очередь.
+        Если пачку отклонила сама БД (ограничение, ошибка в данных), записи
+        повторяются по одной, и не прошедшие отбрасываются с записью в журнал.
+        """
+        total = 0
+        while True:
+            items = self._take()
+            if not items:
+                return total
+            try:
+                conn = db_pool.acquire()
+            except Exception:
+                logger.exception("Отложенная запись: нет соединения для %d записей", len(items))
+                self._failed(items)
+                return total
+            try:
+                written, rest = self._write(conn, items)
+            finally:
+                db_pool.release(conn)
+            total += written
+            if rest:
+                self._failed(rest)
+                return total
+
+    def _failed(self, items):
+        with self._lock:
+            self.errors += 1
+        self._requeue(items)
+
+    def _write(self, conn, items):
+        """Записать пачку; возвращает (записано, что вернуть в очередь)"""
+        grouped = OrderedDict()
+        for _, (sql, params) in items:
+            grouped.setdefault(sql, []).append(params)
+        try:
+            begin_immediate(conn)
+            for sql, rows in grouped.items():
+                conn.executemany(sql, rows)
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if is_busy_error(e):
+                logger.warning("Отложенная запись: БД занята, %d записей ждут следующего сброса", len(items))
+                return 0, items
+            logger.warning("Отложенная запись: пачка из %d записей отклонена (%s), запись по одной",
+                           len(items), e)
+            return self._write_each(conn, items)
+        with self._lock:
+            self.written += len(items)
+            self.flushes += 1
+        return len(items), []
+
+    def _write_each(self, conn, items):
+        """Запись по одной: ошибочная запись не должна задерживать остальные"""
+        written = 0
+        for index, (key, (sql, params)) in enumerate(items):
+            try:
+                begin_immediate(conn)
+                conn.execute(sql, params)
+                conn.commit()
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if is_busy_error(e):
+                    return written, items[index:]
+                logger.error("Отложенная запись: запись %r отброшена: %s", key, e)
+                with self._lock:
+                    self.dropped += 1
+                continue
+            written += 1
+        with self._lock:
+            self.written += written
+            self.flushes += 1
+        return written, []
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Поток не должен умирать: иначе очередь растет без записи
+                logger.exception("Отложенная запись: сбой фонового потока")
+
+    def stop(self):
+        """Остановить поток и дописать очередь (при завершении работы)"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "written": self.written,
+                "flushes": self.flushes,
+                "errors": self.errors,
+                "dropped": self.dropped,
+            }
+
+
+write_behind = WriteBehind()
+atexit.register(write_behind.stop)
+
+
+def record_last_login(guest_id):
+    """Время входа гостя пишется в фоне, запрос входа остается только на чтение"""
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    write_behind.submit(("last_login", guest_id),
+                        "UPDATE guests SET last_login = ? WHERE id = ?", (now, guest_id))
+
+# ============ ПАРОЛИ ============
+
+# Схема хэширования новых паролей: "scrypt" или "pbkdf2_sha256"
+PASSWORD_SCHEME = os.environ.get("HOTEL_PASSWORD_SCHEME", "scrypt")
+# Стоимость: N для scrypt (степень двойки), число итераций для PBKDF2
+SCRYPT_N = int(os.environ.get("HOTEL_SCRYPT_N", 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = int(os.environ.get("HOTEL_PBKDF2_ITERATIONS", 200000))
+PASSWORD_SALT_BYTES = 16
+# Проверка паролей идет в ограниченном пуле потоков
+PASSWORD_WORKERS = int(os.environ.get("HOTEL_PASSWORD_WORKERS", 4))
+PASSWORD_TIMEOUT = 10
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem с запасом: scrypt требует около 128 * n * r байт
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def hash_password(password, scheme=None, cost=None):
+    """Хэширование пароля с солью.
+
+    Формат: scrypt$N$r$p$соль$хэш или pbkdf2_sha256$итерации$соль$хэш
+    """
+    scheme = scheme or PASSWORD_SCHEME
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    if scheme == "scrypt":
+        n = cost or SCRYPT_N
+        digest = _scrypt(password, salt, n, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${n}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    if scheme == "pbkdf2_sha256":
+        iterations = cost or PBKDF2_ITERATIONS
+        digest = _pbkdf2(password, salt, iterations)
+        return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+    raise ValueError(f"Неизвестная схема хэширования: {scheme}")
+
+
+def verify_password(password, stored):
+    """Проверка пароля по сохраненному хэшу (включая старый формат SHA-256)"""
+    parts = stored.split("$")
+    if parts[0] == "scrypt" and len(parts) == 6:
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        digest = _scrypt(password, bytes.fromhex(parts[4]), n, r, p)
+        return hmac.compare_digest(digest.hex(), parts[5])
+    if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+        digest = _pbkdf2(password, bytes.fromhex(parts[2]), int(parts[1]))
+        return hmac.compare_digest(digest.hex(), parts[3])
+    # Старый формат: SHA-256 без соли
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(legacy, stored)
+
+
+def needs_rehash(stored):
+    """Хэш устарел: старый формат, другая схема или другая стоимость"""
+    parts = stored.split("$")
+    if parts[0] != PASSWORD_SCHEME:
+        return True
+    if PASSWORD_SCHEME == "scrypt":
+        return parts[1:4] != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return parts[1] != str(PBKDF2_ITERATIONS)
+
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS,
+                                       thread_name_prefix="password")
+atexit.register(password_executor.shutdown, wait=False)
+
+
+def check_password(password, stored, executor=None):
+    """Проверка пароля в пуле потоков: KDF не занимает больше PASSWORD_WORKERS ядер"""
+    future = (executor or password_executor).submit(verify_password, password, stored)
+    return future.result(timeout=PASSWORD_TIMEOUT)
+
+
+def make_password_hash(password):
+    """Хэширование нового пароля в том же пуле потоков"""
+    return password_executor.submit(hash_password, password).result(timeout=PASSWORD_TIMEOUT)
+
+
+def upgrade_password_hash(cur, table, row_id, password):
+    """Перехэширование пароля текущей схемой после успешного входа"""
+    cur.execute(f"UPDATE {table} SET password_hash = ? WHERE id = ?",
+                (make_password_hash(password), row_id))
+
+
+@app.cli.command("bench-login")
+@click.option("--requests", "total", default=200, help="Число проверок на каждую стоимость")
+@click.option("--workers", default=PASSWORD_WORKERS, help="Размер пула потоков")
+@click.option("--scheme", default=PASSWORD_SCHEME, help="scrypt или pbkdf2_sha256")
+@click.option("--cost", "costs", multiple=True, type=int,
+              help="Стоимость (N для scrypt, итерации для PBKDF2); можно указать несколько")
+def bench_login_command(total, workers, scheme, costs):
+    """Пропускная способность проверки пароля при разной стоимости KDF"""
+    if not costs:
+        costs = ((2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15) if scheme == "scrypt"
+                 else (50000, 100000, 200000, 600000))
+    print(f"📊 {scheme}: {total} проверок, потоков: {workers}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for cost in costs:
+            stored = hash_password("benchmark-password", scheme, cost)
+
+            def one_login():
+                start = time.perf_counter()
+                verify_password("benchmark-password", stored)
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            latencies = sorted(executor.map(lambda _: one_login(), range(total)))
+            elapsed = time.perf_counter() - start
+            p50 = latencies[len(latencies) // 2] * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"  стоимость {cost:>7}: {total / elapsed:8.1f} входов/с, "
+                  f"p50 {p50:.1f} мс, p95 {p95:.1f} мс")
+
+# ============ СТАТИЧЕСКИЕ ФАЙЛЫ ============
+
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+ASSET_MANIFEST_PATH = os.path.join(STATIC_DIR, "manifest.json")
+ASSET_URL_PREFIX = "/assets"
+# CSS в репозитории ссылается на логические /static/...; копии со ссылками
+# на файлы с отпечатком собираются сюда (каталог не хранится в git)
+ASSET_BUILD_SUBDIR = "dist"
+ASSET_BUILD_DIR = os.path.join(STATIC_DIR, ASSET_BUILD_SUBDIR)
+# Файлы с хэшем в имени не меняются - кэшируем на год
+ASSET_MAX_AGE = 31536000
+ASSET_DIGEST_LENGTH = 12
+ASSET_SKIP_SUFFIXES = (".txt", ".json", ".gz", ".br")
+# Сжатие: какие файлы сжимать заранее и с какого размера сжимать ответы
+COMPRESSIBLE_SUFFIXES = (".css", ".js", ".svg", ".html", ".ico", ".json", ".txt")
+COMPRESSIBLE_MIMETYPES = ("text/html", "text/css", "application/json", "application/javascript")
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+HASHED_ASSET_RE = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)?$"
+                             % ASSET_DIGEST_LENGTH)
+CSS_STATIC_URL_RE = re.compile(r"""url\(\s*(['"]?)%s/([^'")\s]+)\1\s*\)"""
+                               % re.escape(app.static_url_path))
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:ASSET_DIGEST_LENGTH]
+
+
+def hashed_name(name, digest):
+    """images/roo.png -> images/roo.<digest>.png"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def compressed_sibling(path, suffix):
+    """Сжатая копия файла (.gz/.br), если она есть и не старше самого файла"""
+    target = path + suffix
+    try:
+        if os.stat(target).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return target
+    except OSError:
+        pass
+    return None
+
+
+def remove_stale_compressed(static_dir=STATIC_DIR):
+    """Удалить .gz/.br, которые старше исходного файла (файл правили после compress-assets)"""
+    removed = []
+    for root, _, files in os.walk(static_dir):
+        for filename in files:
+            if not filename.endswith((".gz", ".br")):
+                continue
+            target = os.path.join(root, filename)
+            source = target[:-3]
+            if os.path.isfile(source) and compressed_sibling(source, filename[-3:]) is None:
+                os.remove(target)
+                removed.append(target)
+    return removed
+
+
+class AssetManifest:
+    """Манифест статических файлов: логическое имя -> отпечаток содержимого.
+
+    Манифест читается из static/manifest.json (flask build-assets), а если
+    его нет - строится при первом обращении. Для каждого файла хранятся
+    размер и mtime: если файл изменили без build-assets, манифест
+    пересчитывается при следующем обращении к этому файлу.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, manifest_path=ASSET_MANIFEST_PATH):
+        self.static_dir = static_dir
+        self.manifest_path = manifest_path
+        self._digests = None
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, name):
+        """(размер, mtime) файла; None, если файла нет"""
+        try:
+            st = os.stat(os.path.join(self.static_dir, *name.split("/")))
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def scan(self):
+        """Посчитать отпечатки всех файлов в static/; возвращает (отпечатки, размеры и mtime).
+
+        CSS обрабатывается последним: ссылки url(/static/...) в нем заменяются
+        на URL с отпечатком, копия пишется в ASSET_BUILD_DIR, а отпечаток
+        считается по переписанному содержимому.
+        """
+        digests = {}
+        stamps = {}
+        stylesheets = []
+        build_dir = os.path.join(self.static_dir, ASSET_BUILD_SUBDIR)
+        for root, dirs, files in os.walk(self.static_dir):
+            if root == self.static_dir and ASSET_BUILD_SUBDIR in dirs:
+                dirs.remove(ASSET_BUILD_SUBDIR)
+            for filename in files:
+                if filename.endswith(ASSET_SKIP_SUFFIXES):
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                stamps[name] = self._stamp(name)
+                if filename.endswith(".css"):
+                    stylesheets.append((name, path))
+                else:
+                    digests[name] = _file_digest(path)
+        for name, path in stylesheets:
+            digests[name] = self._build_css(name, path, digests, build_dir)
+        return digests, stamps
+
+    def _build_css(self, name, path, digests, build_dir):
+        """Переписать url(/static/...) на URL с отпечатком; вернуть отпечаток результата"""
+        with open(path, encoding="utf-8", newline="") as f:
+            text = f.read()
+
+        def replace(match):
+            digest = digests.get(match.group(2))
+            if digest is None:
+                return match.group(0)
+            return f"url('{ASSET_URL_PREFIX}/{hashed_name(match.group(2), digest)}')"
+
+        built = CSS_STATIC_URL_RE.sub(replace, text)
+        target = os.path.join(build_dir, *name.split("/"))
+        if built == text:
+            if os.path.exists(target):
+                os.remove(target)
+            return _file_digest(path)
+        data = built.encode("utf-8")
+        try:
+            with open(target, "rb") as f:
+                changed = f.read() != data
+        except OSError:
+            changed = True
+        if changed:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+            # Сжатые копии старой сборки больше не соответствуют файлу
+            for suffix in (".gz", ".br"):
+                if os.path.exists(target + suffix):
+                    os.remove(target + suffix)
+        return hashlib.sha256(data).hexdigest()[:ASSET_DIGEST_LENGTH]
+
+    def build(self):
+        """Пересчитать манифест и записать его на диск"""
+        digests, stamps = self.scan()
+        for target in remove_stale_compressed(self.static_dir):
+            logger.info("Удалена устаревшая сжатая копия %s", os.path.relpath(target, self.static_dir))
+        entries = {name: {"digest": digest, "size": stamps[name][0], "mtime": stamps[name][1]}
+                   for name, digest in digests.items()}
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        with self._lock:
+            self._digests, self._stamps = digests, stamps
+        return digests
+
+    def _load(self):
+        with open(self.manifest_path, encoding="utf-8") as f:
+            entries = json.load(f)
+        if not all(isinstance(entry, dict) for entry in entries.values()):
+            raise ValueError("манифест старого формата")
+        digests = {name: entry["digest"] for name, entry in entries.items()}
+        stamps = {name: [entry["size"], entry["mtime"]] for name, entry in entries.items()}
+        return digests, stamps
+
+    def digests(self):
+        if self._digests is None:
+            with self._lock:
+                if self._digests is None:
+                    try:
+                        self._digests, self._stamps = self._load()
+                    except (OSError, ValueError, KeyError):
+                        self._digests, self._stamps = self.scan()
+        return self._digests
+
+    def digest(self, name):
+        """Отпечаток файла; если файл изменился после сборки манифеста - пересчитать"""
+        digest = self.digests().get(name)
+        if digest is not None and self._stamp(name) != self._stamps.get(name):
+            with self._lock:
+                if self._stamp(name) != self._stamps.get(name):
+                    logger.info("Файл %s изменен после сборки манифеста - пересчет отпечатков", name)
+                    self._digests, self._stamps = self.scan()
+            digest = self._digests.get(name)
+        return digest
+
+    def url(self, name):
+        """URL файла с отпечатком; для неизвестного файла - обычный /static/"""
+        name = name.lstrip("/")
+        digest = self.digest(name)
+        if digest is None:
+            return url_for("static", filename=name)
+        return f"{ASSET_URL_PREFIX}/{hashed_name(name, digest)}"
+
+
+asset_manifest = AssetManifest()
+
+
+@app.template_global()
+def asset_url(name):
+    """Аналог url_for('static', ...) для шаблонов: {{ asset_url('images/roo.png') }}"""
+    return asset_manifest.url(name)
+
+
+@app.route(ASSET_URL_PREFIX + "/<path:filename>")
+def asset(filename):
+    """Статический файл по URL с отпечатком (Cache-Control: immutable, ETag/304)"""
+    match = HASHED_ASSET_RE.match(filename)
+    if not match:
+        abort(404)
+    name = match.group("stem") + (match.group("ext") or "")
+    digest = asset_manifest.digest(name)
+    if digest is None:
+        abort(404)
+
+    response = send_static(name, digest)
+    if digest == match.group("digest"):
+        response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    else:
+        # Старая ссылка (например, из кэша страниц): отдаем текущий файл без immutable
+        response.headers["Cache-Control"] = "public, max-age=60"
+    return response.make_conditional(request)
+
+
+def accepted_encoding():
+    """Лучшее из доступных сжатий по Accept-Encoding: br, gzip или None"""
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def send_static(name, etag=None):
+    """Отдать файл из static/, выбрав заранее сжатую копию (.br/.gz), если она есть.
+
+    Для CSS берется собранная копия из ASSET_BUILD_DIR, если она есть.
+    """
+    mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    directory = STATIC_DIR
+    if name.endswith(".css") and os.path.isfile(os.path.join(ASSET_BUILD_DIR, name)):
+        directory = ASSET_BUILD_DIR
+    encoding = suffix = None
+    if name.endswith(COMPRESSIBLE_SUFFIXES):
+        # Готовую .br можно отдать и без установленного brotli
+        for candidate, candidate_suffix in (("br", ".br"), ("gzip", ".gz")):
+            # Копию старше исходного файла не отдаем: она от прошлой версии
+            if (request.accept_encodings[candidate]
+                    and compressed_sibling(os.path.join(directory, name), candidate_suffix)):
+                encoding, suffix = candidate, candidate_suffix
+                break
+
+    response = send_from_directory(directory, name + (suffix or ""), mimetype=mimetype,
+                                   conditional=etag is None)
+    if name.endswith(COMPRESSIBLE_SUFFIXES):
+        response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if etag:
+        # У каждой сжатой копии свой ETag
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    return response
+
+
+def static_file(filename):
+    """Замена стандартного /static/: те же файлы, но с учетом .br/.gz.
+
+    ETag и 304 - по mtime и размеру отдаваемого файла (как у Flask), без манифеста.
+    """
+    return send_static(filename)
+
+
+app.view_functions["static"] = static_file
+
+
+def compress_file(path):
+    """Записать рядом с файлом .gz и .br, если они меньше оригинала"""
+    with open(path, "rb") as f:
+        data = f.read()
+    written = []
+    variants = [(".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", lambda: brotli.compress(data, quality=11)))
+    for suffix, compress in variants:
+        packed = compress()
+        target = path + suffix
+        if len(packed) < len(data):
+            with open(target, "wb") as f:
+                f.write(packed)
+            written.append((target, len(packed)))
+        elif os.path.exists(target):
+            os.remove(target)
+    return len(data), written
+
+
+@app.cli.command("compress-assets")
+def compress_assets_command():
+    """Заранее сжать текстовые файлы static/ в .gz (и .br, если есть brotli)"""
+    if brotli is None:
+        print("⚠️ brotli не установлен - создаются только .gz")
+    count = 0
+    for root, _, files in os.walk(STATIC_DIR):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if not filename.endswith(COMPRESSIBLE_SUFFIXES) or os.path.getsize(path) < COMPRESS_MIN_SIZE:
+                continue
+            size, written = compress_file(path)
+            for target, packed in written:
+                count += 1
+                print(f"  {os.path.relpath(target, STATIC_DIR)}: {size} -> {packed} байт")
+    print(f"✅ Сжатых копий: {count}")
+
+
+@app.after_request
+def compress_response(response):
+    """Сжатие динамических ответов (HTML, JSON) больше COMPRESS_MIN_SIZE"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding()
+    if encoding == "br":
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    elif encoding == "gzip":
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    else:
+        return response
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Построить манифест статических файлов (static/manifest.json)"""
+    digests = asset_manifest.build()
+    for name, digest in sorted(digests.items()):
+        print(f"  {hashed_name(name, digest)}")
+    print(f"✅ Манифест: {len(digests)} файлов -> {asset_manifest.manifest_path}")
+
+# ============ СТИЛИ ============
+
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+SHARED_CSS = "css/site.css"
+PAGE_CSS_DIR = "css/pages"
+# Правило попадает в общий файл, если оно встречается хотя бы на стольких страницах
+CSS_SHARED_MIN_PAGES = 2
+STYLE_BLOCK_RE = re.compile(r"^([ \t]*)<style>(.*?)</style>[ \t]*(?=\r?$)", re.S | re.M)
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+TEMPLATE_ASSET_RE = re.compile(r"""\{\{\s*asset_url\(\s*["']([^"']+)["']\s*\)\s*\}\}""")
+
+
+def minify_css(css):
+    """Удалить комментарии и лишние пробелы"""
+    css = CSS_COMMENT_RE.sub("", css)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def split_css_rules(css):
+    """Разбить минифицированный CSS на правила верхнего уровня (@media - целиком)"""
+    rules = []
+    depth = start = 0
+    for i, char in enumerate(css):
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                rules.append(css[start:i + 1])
+                start = i + 1
+    return rules
+
+
+def _css_selectors(rule):
+    """Селекторы правила; для @media - селекторы вложенных правил"""
+    head = rule[:rule.index("{")]
+    if head.startswith("@"):
+        inner = split_css_rules(rule[rule.index("{") + 1:-1])
+        return set().union(*(_css_selectors(r) for r in inner)) if inner else set()
+    return set(head.split(","))
+
+
+def _cascade_safe(rules, sequence):
+    """Правила с общими селекторами идут в sequence в том же порядке, что в rules"""
+    position = {rule: i for i, rule in enumerate(sequence)}
+    for i, first in enumerate(rules):
+        for second in rules[i + 1:]:
+            if position[first] > position[second] and _css_selectors(first) & _css_selectors(second):
+                return False
+    return True
+
+
+def plan_stylesheets(pages, shared_existing=()):
+    """Разделить правила страниц на общий файл и собственные файлы страниц.
+
+    Общий файл подключают только страницы, в стилях которых были все его
+    правила, поэтому чужие правила на страницу не попадают. Правило
+    добавляется в общий файл, если это увеличивает экономию и не меняет
+    порядок каскада ни на одной из подключающих страниц.
+    Возвращает (общие правила, страницы с общим файлом, {страница: правила}).
+    """
+    def family(shared):
+        return [name for name in sorted(pages) if set(shared) <= set(pages[name])]
+
+    def layout_safe(shared, names):
+        return all(_cascade_safe(pages[name], shared + [r for r in pages[name] if r not in shared])
+                   for name in names)
+
+    if shared_existing:
+        shared = list(shared_existing)
+    else:
+        counts = {}
+        for rules in pages.values():
+            for rule in set(rules):
+                counts[rule] = counts.get(rule, 0) + 1
+        shared, best = [], 0
+        for rule in sorted(counts, key=lambda r: (-counts[r], r)):
+            if counts[rule] < CSS_SHARED_MIN_PAGES:
+                break
+            names = family(shared + [rule])
+            if len(names) < CSS_SHARED_MIN_PAGES:
+                continue
+            trial = set(shared) | {rule}
+            # Порядок общих правил - как на первой подключающей странице
+            ordered = list(dict.fromkeys(r for r in pages[names[0]] if r in trial))
+            if not layout_safe(ordered, names):
+                continue
+            saving = (len(names) - 1) * sum(len(r) for r in ordered)
+            if saving > best:
+                shared, best = ordered, saving
+
+    linked = set(family(shared)) if shared else set()
+    linked = {name for name in linked if layout_safe(shared, [name])}
+    page_rules = {name: [r for r in rules if name not in linked or r not in shared]
+                  for name, rules in pages.items()}
+    return shared, linked, page_rules
+
+
+def _write_css(name, rules):
+    path = os.path.join(STATIC_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        # Одно правило на строку: файл маленький, но читается в diff
+        f.write("\n".join(rules) + "\n")
+
+
+def extract_template_css(templates_dir=TEMPLATES_DIR):
+    """Вынести блоки <style> шаблонов в общий и постраничные файлы CSS.
+
+    Шаблоны переписываются на <link> через asset_url(); ссылки
+    {{ asset_url(...) }} внутри CSS заменяются логическими /static/...,
+    а URL с отпечатком подставляет сборка манифеста.
+    Возвращает (число общих правил, {шаблон: (общий файл подключен, число собственных правил)}).
+    """
+    sources = {}
+    pages = {}
+    for filename in sorted(os.listdir(templates_dir)):
+        if not filename.endswith(".html"):
+            continue
+        path = os.path.join(templates_dir, filename)
+        with open(path, encoding="utf-8", newline="") as f:
+            text = f.read()
+        match = STYLE_BLOCK_RE.search(text)
+        if not match:
+            continue
+        css = TEMPLATE_ASSET_RE.sub(lambda m: f"{app.static_url_path}/{m.group(1)}", match.group(2))
+        name = os.path.splitext(filename)[0]
+        sources[name] = (path, text, match)
+        pages[name] = split_css_rules(minify_css(css))
+    if not pages:
+        return 0, {}
+
+    shared_path = os.path.join(STATIC_DIR, SHARED_CSS)
+    shared_existing = []
+    if os.path.exists(shared_path):
+        with open(shared_path, encoding="utf-8") as f:
+            shared_existing = split_css_rules(minify_css(f.read()))
+    shared, linked, page_rules = plan_stylesheets(pages, shared_existing)
+    if shared and shared != shared_existing:
+        _write_css(SHARED_CSS, shared)
+
+    # Страницы с одинаковыми стилями (ekonom_room/ekonom_admin) делят один файл
+    page_files = {}
+    for name in sorted(page_rules):
+        page_files.setdefault(tuple(page_rules[name]), f"{PAGE_CSS_DIR}/{name}.css")
+
+    for name, (path, text, match) in sources.items():
+        indent = match.group(1)
+        links = []
+        if name in linked:
+            links.append(f'{indent}<link rel="stylesheet" href="{{{{ asset_url(\'{SHARED_CSS}\') }}}}">')
+        if page_rules[name]:
+            page_css = page_files[tuple(page_rules[name])]
+            _write_css(page_css, page_rules[name])
+            links.append(f'{indent}<link rel="stylesheet" href="{{{{ asset_url(\'{page_css}\') }}}}">')
+        newline = "\r\n" if "\r\n" in text else "\n"
+        text = text[:match.start()] + newline.join(links) + text[match.end():]
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+    asset_manifest.build()
+    return len(shared), {name: (name in linked, len(rules)) for name, rules in page_rules.items()}
+
+
+@app.cli.command("extract-css")
+def extract_css_command():
+    """Вынести inline-стили шаблонов в static/css и подключить их через <link>"""
+    shared, pages = extract_template_css()
+    if not pages:
+        print("✅ В шаблонах нет блоков <style>")
+        return
+    for name, (linked, count) in sorted(pages.items()):
+        print(f"  {name}.html: {'общий + ' if linked else ''}собственных правил {count}")
+    print(f"✅ Общих правил в {SHARED_CSS}: {shared}; манифест обновлен")
+
+# ============ ВАРИАНТЫ ИЗОБРАЖЕНИЙ ============
+
+IMAGE_SOURCE_DIR = os.path.join(STATIC_DIR, "images")
+IMAGE_VARIANTS_DIR = os.path.join(STATIC_DIR, "variants")
+IMAGE_WIDTHS = (480, 960, 1600)
+IMAGE_FORMATS = ("avif", "webp")
+IMAGE_QUALITY = {"webp": 80, "avif": 55}
+IMAGE_SOURCE_SUFFIXES = (".png", ".jpg", ".jpeg")
+# Иконки меньше этого размера не пережимаем
+IMAGE_MIN_BYTES = 32 * 1024
+IMAGE_SIZES = "(max-width: 768px) 100vw, 50vw"
+VARIANT_RE = re.compile(r"^variants/(?P<source>.+)\.(?P<width>\d+)\.(?P<format>[a-z]+)$")
+
+
+def image_formats():
+    """Форматы, которые умеет сохранять установленный Pillow"""
+    if Image is None:
+        return ()
+    try:
+        import pillow_avif  # noqa: F401 - регистрирует AVIF в старых версиях Pillow
+    except ImportError:
+        pass
+    Image.init()
+    return tuple(fmt for fmt in IMAGE_FORMATS if fmt.upper() in Image.SAVE)
+
+
+def make_image_variants(source, name, out_dir, widths, formats):
+    """Варианты одного изображения (выполняется в процессе пула).
+
+    Копии не шире оригинала; уже собранные и не устаревшие
+    файлы пропускаются. Возвращает список (путь, размер в байтах).
+    """
+    stem = os.path.splitext(name)[0]
+    source_mtime = os.path.getmtime(source)
+    result = []
+    with Image.open(source) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        # Последний вариант - в полную ширину (но не больше максимальной)
+        full = min(img.width, max(widths))
+        targets = sorted({w for w in widths if w < full} | {full})
+        for width in targets:
+            height = round(img.height * width / img.width)
+            resized = None
+            for fmt in formats:
+                path = os.path.join(out_dir, f"{stem}.{width}.{fmt}")
+                if os.path.exists(path) and os.path.getmtime(path) >= source_mtime:
+                    result.append((path, os.path.getsize(path)))
+                    continue
+                if resized is None:
+                    resized = img.resize((width, height), Image.LANCZOS)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                resized.save(path, fmt.upper(), quality=IMAGE_QUALITY[fmt])
+                result.append((path, os.path.getsize(path)))
+    return result
+
+
+def build_image_variants(workers=None, widths=IMAGE_WIDTHS):
+    """Собрать варианты всех изображений static/images в пуле процессов"""
+    formats = image_formats()
+    if not formats:
+        raise RuntimeError("Pillow не установлен или не поддерживает WebP/AVIF")
+    jobs = []
+    for root, _, files in os.walk(IMAGE_SOURCE_DIR):
+        for filename in files:
+            path = os.path.join(root, filename)
+            # Иконки и пустые файлы-заглушки из create_missing_images пропускаем
+            if (filename.lower().endswith(IMAGE_SOURCE_SUFFIXES)
+                    and os.path.getsize(path) >= IMAGE_MIN_BYTES):
+                name = os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+                jobs.append((path, name))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(make_image_variants, path, name, IMAGE_VARIANTS_DIR, widths, formats): path
+            for path, name in jobs
+        }
+        return {futures[future]: future.result() for future in futures}
+
+
+class ImageVariants:
+    """Индекс вариантов по манифесту: исходный файл -> {формат: [(ширина, имя)]}"""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self._index = None
+        self._digests = None
+
+    def index(self):
+        digests = self.manifest.digests()
+        if self._digests is not digests:
+            index = {}
+            for name in digests:
+                match = VARIANT_RE.match(name)
+                if match:
+                    formats = index.setdefault(match.group("source"), {})
+                    formats.setdefault(match.group("format"), []).append(
+                        (int(match.group("width")), name))
+            for formats in index.values():
+                for variants in formats.values():
+                    variants.sort()
+            self._index, self._digests = index, digests
+        return self._index
+
+    def srcset(self, name, fmt):
+        variants = self.index().get(os.path.splitext(name)[0], {}).get(fmt, [])
+        return ", ".join(f"{self.manifest.url(variant)} {width}w" for width, variant in variants)
+
+    def formats(self, name):
+        found = self.index().get(os.path.splitext(name)[0], {})
+        return [fmt for fmt in IMAGE_FORMATS if fmt in found]
+
+
+image_variants = ImageVariants(asset_manifest)
 
-def hash_password(password):
-    """Хэширование пароля"""
-    return hashlib.sha256(password.encode()).hexdigest()
 
-def init_db():
-    """Создание базы данных и таблиц"""
-    print("🔄 Инициализация базы данных...")
-    
-    conn = None
+@app.template_global()
+def responsive_image(name, alt="", sizes=IMAGE_SIZES, loading="lazy"):
+    """<picture> с srcset по вариантам AVIF/WebP; без вариантов - обычный <img>"""
+    img = Markup('<img src="{}" alt="{}" loading="{}">').format(asset_url(name), alt, loading)
+    sources = [
+        Markup('<source type="image/{}" srcset="{}" sizes="{}">').format(
+            fmt, image_variants.srcset(name, fmt), sizes)
+        for fmt in image_variants.formats(name)
+    ]
+    if not sources:
+        return img
+    return Markup("<picture>") + Markup("").join(sources) + img + Markup("</picture>")
+
+
+@app.cli.command("build-images")
+@click.option("--workers", default=None, type=int, help="Число процессов (по умолчанию - по числу ядер)")
+def build_images_command(workers):
+    """Собрать уменьшенные WebP/AVIF-варианты изображений и обновить манифест"""
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        
-        # Таблица гостей
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS guests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                full_name VARCHAR(100),
-                phone VARCHAR(20),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_login DATETIME
-            )
-        ''')
-        
-        # Таблица администраторов
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                email VARCHAR(255),
-                full_name VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица типов номеров
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS room_types (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name VARCHAR(50) NOT NULL,
-                description TEXT,
-                price_per_night DECIMAL(10,2),
-                capacity INTEGER,
-                amenities TEXT
-            )
-        ''')
-        
-        # Таблица бронирований
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guest_id INTEGER NOT NULL,
-                room_type_id INTEGER,
-                full_name VARCHAR(100) NOT NULL,
-                passport VARCHAR(50),
-                phone VARCHAR(20),
-                check_in_date DATE,
-                check_out_date DATE,
-                status VARCHAR(20) DEFAULT 'pending',
-                total_price DECIMAL(10,2),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (guest_id) REFERENCES guests(id),
-                FOREIGN KEY (room_type_id) REFERENCES room_types(id)
-            )
-        ''')
-        
-        # Таблица отзывов
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guest_id INTEGER NOT NULL,
-                rating INTEGER CHECK(rating BETWEEN 1 AND 5),
-                comment TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (guest_id) REFERENCES guests(id)
-            )
-        ''')
-        
-        # Добавляем тестовые данные
-        cur.execute("SELECT COUNT(*) FROM admins WHERE username = 'admin'")
-        if cur.fetchone()[0] == 0:
-            cur.execute(
-                "INSERT INTO admins (username, password_hash, email, full_name) VALUES (?, ?, ?, ?)",
-                ('admin', hash_password('admin123'), 'admin@hotel.com', 'Главный администратор')
-            )
-            print("✅ Создан администратор: admin / admin123")
-        
-        cur.execute("SELECT COUNT(*) FROM room_types")
-        if cur.fetchone()[0] == 0:
-            room_types = [
-                ('Экономный', 'Бюджетный номер с базовыми удобствами', 1500.00, 1, 'Wi-Fi, душ, телевизор'),
-                ('Стандартный', 'Комфортабельный номер для 2-х человек', 2500.00, 2, 'Wi-Fi, кондиционер, мини-бар'),
-                ('Люксовый', 'Просторный номер с улучшенным сервисом', 5000.00, 2, 'Wi-Fi, джакузи, персональный дворецкий')
-            ]
-            cur.executemany(
-                "INSERT INTO room_types (name, description, price_per_night, capacity, amenities) VALUES (?, ?, ?, ?, ?)",
-                room_types
-            )
-            print("✅ Созданы типы номеров")
-        
-        conn.commit()
-        print("✅ База данных успешно инициализирована")
-        
-    except Exception as e:
-        print(f"❌ Ошибка при инициализации БД: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+        results = build_image_variants(workers)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    for source, variants in sorted(results.items()):
+        original = os.path.getsize(source)
+        smallest = min((size for _, size in variants), default=original)
+        print(f"  {os.path.relpath(source, STATIC_DIR)}: {len(variants)} вариантов, "
+              f"{original // 1024} КБ -> от {smallest // 1024} КБ")
+    asset_manifest.build()
+    print(f"✅ Варианты собраны в {IMAGE_VARIANTS_DIR}, манифест обновлен")
 
 # ============ ДЕКОРАТОРЫ ДЛЯ ПРОВЕРКИ АВТОРИЗАЦИИ ============
 
@@ -250,6 +2756,7 @@ def admin_required(f):
 # ============ МАРШРУТЫ ============
 
 @app.route("/")
+@cached_page
 def index():
     """Главная страница"""
     is_logged_in = "guest_id" in session
@@ -261,6 +2768,14 @@ def index():
 
 # ============ АВТОРИЗАЦИЯ И РЕГИСТРАЦИЯ ============
 
+def unique_violation(error):
+    """Столбец из ошибки "UNIQUE constraint failed: guests.email" (или None)"""
+    message = str(error)
+    prefix = "UNIQUE constraint failed: "
+    if not message.startswith(prefix):
+        return None
+    return message[len(prefix):].split(",")[0].split(".")[-1].strip()
+
 @app.route("/avtorizacia_page", methods=["GET", "POST"])
 def avtorizacia_page():
     """Страница авторизации пользователя"""
@@ -268,12 +2783,10 @@ def avtorizacia_page():
         username = request.form.get("username")
         password = request.form.get("password")
         
-        print(f"=== ДЕБАГ АВТОРИЗАЦИИ ===")
-        print(f"Логин из формы: '{username}'")
-        print(f"Пароль из формы: '{password}'")
+        logger.debug("Авторизация: логин %r", username)
         
         if not username or not password:
-            print("Ошибка: пустой логин или пароль")
+            logger.debug("Авторизация: пустой логин или пароль")
             flash("Логин и пароль обязательны", "error")
             return render_template("avtorizacia_page.html")
         
@@ -282,66 +2795,53 @@ def avtorizacia_page():
             conn = get_db()
             cur = conn.cursor()
             
-            print(f"Ищу пользователя '{username}' в БД...")
             cur.execute("SELECT * FROM guests WHERE username = ?", (username,))
             guest = cur.fetchone()
             
             if not guest:
-                print(f"Пользователь '{username}' не найден в БД")
+                logger.info("Авторизация: пользователь %r не найден", username)
                 flash("Пользователь не найден", "error")
                 return render_template("avtorizacia_page.html")
             
-            print(f"Пользователь найден: ID={guest['id']}, логин={guest['username']}")
-            print(f"Пароль из БД (хэш): {guest['password_hash']}")
+            logger.debug("Авторизация: найден пользователь id=%s", guest["id"])
             
-            # Хэшируем введенный пароль
-            input_hash = hash_password(password)
-            print(f"Введенный пароль (хэш): {input_hash}")
-            
-            if guest["password_hash"] != input_hash:
-                print("Пароли не совпадают!")
+            if not check_password(password, guest["password_hash"]):
+                logger.info("Авторизация: неверный пароль для %r", username)
                 flash("Неверный пароль", "error")
                 return render_template("avtorizacia_page.html")
             
-            print("Пароль верный! Устанавливаю сессию...")
+            # Хэш старого формата или с другой стоимостью - перехэшируем
+            if needs_rehash(guest["password_hash"]):
+                upgrade_password_hash(cur, "guests", guest["id"], password)
+                conn.commit()
+                logger.info("Авторизация: хэш пароля обновлен для guest_id=%s", guest["id"])
             
             # Устанавливаем сессию
             session["guest_id"] = guest["id"]
             session["guest_username"] = guest["username"]
             session["guest_email"] = guest["email"]
             
-            print(f"Сессия установлена: guest_id={session['guest_id']}")
+            logger.info("Авторизация: вход guest_id=%s", guest["id"])
             
-            # Обновляем время последнего входа
-            cur.execute(
-                "UPDATE guests SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
-                (guest["id"],)
-            )
-            conn.commit()
+            # Обновляем время последнего входа (в фоне)
+            record_last_login(guest["id"])
             
-            print("Успех! Редирект на главную...")
             flash("Вы успешно вошли в систему!", "success")
             
             # Если был сохранен next_url (например, из booking_process), редиректим туда
             next_url = session.pop("next_url", None)
             if next_url:
-                print(f"Редирект на сохраненный URL: {next_url}")
+                logger.debug("Авторизация: редирект на %s", next_url)
                 return redirect(next_url)
             
             return redirect(url_for("index"))
             
         except Exception as e:
-            print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Ошибка при авторизации")
             flash(f"Ошибка при авторизации: {str(e)}", "error")
             return render_template("avtorizacia_page.html")
-        finally:
-            if conn:
-                conn.close()
     
     # GET запрос
-    print("GET запрос на страницу авторизации")
     return render_template("avtorizacia_page.html")
 
 
@@ -355,69 +2855,62 @@ def registrazia_page():
         confirm_password = request.form.get("confirm_password", "")
         
         # Дебаг логирование
-        print(f"=== ДЕБАГ РЕГИСТРАЦИИ ===")
-        print(f"Логин: '{username}'")
-        print(f"Email: '{email}'")
-        print(f"Пароль длина: {len(password)}")
-        print(f"Подтверждение длина: {len(confirm_password)}")
+        logger.debug("Регистрация: логин %r, email %r", username, email)
         
         # Проверка обязательных полей
         if not username or not email or not password or not confirm_password:
-            print("Ошибка: не все поля заполнены")
+            logger.debug("Регистрация: не все поля заполнены")
             flash("Все поля обязательны для заполнения", "error")
             return render_template("registrazia_page.html")
         
         # Проверка совпадения паролей
         if password != confirm_password:
-            print(f"Ошибка: пароли не совпадают. Пароль: '{password[:3]}...', Подтверждение: '{confirm_password[:3]}...'")
+            logger.debug("Регистрация: пароли не совпадают")
             flash("Пароли не совпадают", "error")
             return render_template("registrazia_page.html")
         
         # Проверка длины пароля
         if len(password) < 6:
-            print(f"Ошибка: пароль слишком короткий ({len(password)} символов)")
+            logger.debug("Регистрация: пароль слишком короткий (%d символов)", len(password))
             flash("Пароль должен быть не менее 6 символов", "error")
             return render_template("registrazia_page.html")
         
+        # Проверка валидности email
+        if '@' not in email or '.' not in email:
+            logger.debug("Регистрация: некорректный email %r", email)
+            flash("Введите корректный email адрес", "error")
+            return render_template("registrazia_page.html")
+        
         conn = None
         try:
             conn = get_db()
             cur = conn.cursor()
             
-            # Проверка существующего пользователя
-            cur.execute("SELECT id FROM guests WHERE username = ?", (username,))
-            existing_user = cur.fetchone()
-            if existing_user:
-                print(f"Ошибка: пользователь '{username}' уже существует")
-                flash(f"Пользователь с логином '{username}' уже существует", "error")
-                return render_template("registrazia_page.html")
-            
-            # Проверка существующего email
-            cur.execute("SELECT id FROM guests WHERE email = ?", (email,))
-            existing_email = cur.fetchone()
-            if existing_email:
-                print(f"Ошибка: email '{email}' уже зарегистрирован")
-                flash(f"Пользователь с email '{email}' уже зарегистрирован", "error")
-                return render_template("registrazia_page.html")
+            password_hash = make_password_hash(password)
             
-            # Проверка валидности email
-            if '@' not in email or '.' not in email:
-                print(f"Ошибка: некорректный email '{email}'")
-                flash("Введите корректный email адрес", "error")
+            # Уникальность логина и email проверяет сама БД (UNIQUE)
+            try:
+                cur.execute(
+                    "INSERT INTO guests (username, email, password_hash) VALUES (?, ?, ?)",
+                    (username, email, password_hash)
+                )
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                column = unique_violation(e)
+                if column == "username":
+                    logger.info("Регистрация: логин %r уже занят", username)
+                    flash(f"Пользователь с логином '{username}' уже существует", "error")
+                elif column == "email":
+                    logger.info("Регистрация: email %r уже зарегистрирован", email)
+                    flash(f"Пользователь с email '{email}' уже зарегистрирован", "error")
+                else:
+                    raise
                 return render_template("registrazia_page.html")
             
-            password_hash = hash_password(password)
-            
-            # Вставляем нового пользователя
-            cur.execute(
-                "INSERT INTO guests (username, email, password_hash) VALUES (?, ?, ?)",
-                (username, email, password_hash)
-            )
-            
             guest_id = cur.lastrowid
             conn.commit()
             
-            print(f"✅ Успешная регистрация! ID: {guest_id}, Логин: {username}")
+            logger.info("Регистрация: создан гость id=%s, логин %r", guest_id, username)
             
             # Устанавливаем сессию
             session["guest_id"] = guest_id
@@ -428,25 +2921,76 @@ def registrazia_page():
             return redirect("/")
             
         except sqlite3.Error as e:
-            print(f"❌ Ошибка SQLite при регистрации: {str(e)}")
+            logger.exception("Ошибка SQLite при регистрации")
             if conn:
                 conn.rollback()
             flash(f"Ошибка базы данных: {str(e)}", "error")
             return render_template("registrazia_page.html")
         except Exception as e:
-            print(f"❌ Общая ошибка при регистрации: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Ошибка при регистрации")
             flash(f"Ошибка при регистрации: {str(e)}", "error")
             return render_template("registrazia_page.html")
-        finally:
-            if conn:
-                conn.close()
     
     # GET запрос - просто показываем форму
-    print("GET запрос на страницу регистрации")
     return render_template("registrazia_page.html")
 
+GUEST_IMPORT_BATCH = 5000
+GUEST_IMPORT_COLUMNS = ("username", "email", "password_hash", "full_name", "phone", "created_at")
+
+GUEST_IMPORT_SQL = '''
+    INSERT INTO guests (username, email, password_hash, full_name, phone, created_at)
+    VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    ON CONFLICT DO NOTHING
+'''
+
+
+@app.cli.command("import-guests")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch", default=GUEST_IMPORT_BATCH, help="Строк в одной транзакции")
+def import_guests_command(csv_path, batch):
+    """Массовый импорт гостей из CSV (username, email, password_hash, ...).
+
+    Хэши старой системы (SHA-256) принимаются как есть и перехэшируются
+    при первом входе. Дубликаты по логину или email пропускаются.
+    """
+    conn = db_pool.acquire()
+    read = inserted = invalid = 0
+    start = time.perf_counter()
+
+    def write(rows):
+        begin_immediate(conn)
+        cur = conn.executemany(GUEST_IMPORT_SQL, rows)
+        conn.commit()
+        return cur.rowcount
+
+    try:
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            rows = []
+            for record in csv.DictReader(f):
+                read += 1
+                values = [(record.get(column) or "").strip() or None for column in GUEST_IMPORT_COLUMNS]
+                if not all(values[:3]):
+                    invalid += 1
+                    continue
+                rows.append(values)
+                if len(rows) >= batch:
+                    inserted += write(rows)
+                    rows = []
+            if rows:
+                inserted += write(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_pool.release(conn)
+
+    # Кэш панели живет в процессах веб-сервера; новые гости появятся в нем
+    # не позже чем через DASHBOARD_TTL секунд
+    elapsed = time.perf_counter() - start
+    print(f"✅ Импорт: прочитано {read}, добавлено {inserted}, "
+          f"дубликатов {read - invalid - inserted}, без обязательных полей {invalid} "
+          f"({elapsed:.2f} с)")
+
 @app.route("/booking_process", methods=["GET", "POST"])
 @login_required
 def booking_process():
@@ -456,8 +3000,7 @@ def booking_process():
         conn = get_db()
         cur = conn.cursor()
         
-        cur.execute("SELECT * FROM room_types ORDER BY price_per_night")
-        room_types = cur.fetchall()
+        room_types = room_catalog.all()
         
         if request.method == "POST":
             full_name = request.form.get("fullname", "").strip()
@@ -468,14 +3011,8 @@ def booking_process():
             check_out_str = request.form.get("departure", "").strip()
             consent = request.form.get("consent")
             
-            print(f"=== ДЕБАГ БРОНИРОВАНИЯ ===")
-            print(f"ФИО: {full_name}")
-            print(f"Паспорт: {passport}")
-            print(f"Телефон: {phone}")
-            print(f"Тип номера: {room_type_name}")
-            print(f"Дата заезда: {check_in_str}")
-            print(f"Дата выезда: {check_out_str}")
-            print(f"Согласие: {consent}")
+            logger.debug("Бронирование: %r, номер %r, %s - %s, согласие=%s",
+                         full_name, room_type_name, check_in_str, check_out_str, bool(consent))
             
             # Проверка заполнения всех полей
             if not all([full_name, passport, phone, room_type_name, check_in_str, check_out_str]):
@@ -508,79 +3045,37 @@ def booking_process():
                     return render_template("booking_process.html", room_types=room_types)
                 
                 # Проверяем существование типа номера
-                cur.execute("SELECT id, name, price_per_night, capacity FROM room_types WHERE name = ?", (room_type_name,))
-                room_type = cur.fetchone()
+                room_type = room_catalog.get_by_name(room_type_name)
                 
                 if not room_type:
                     flash(f"Тип номера '{room_type_name}' не найден", "error")
                     return render_template("booking_process.html", room_types=room_types)
                 
-                print(f"Найден тип номера: ID={room_type['id']}, Название={room_type['name']}")
+                logger.debug("Бронирование: тип номера id=%s (%s)", room_type["id"], room_type["name"])
                 
                 # ============ ПРОВЕРКА 1: Бронирование уже существующего номера на эти даты ============
-                cur.execute('''
-                    SELECT COUNT(*) as count, 
-                           GROUP_CONCAT(DISTINCT b.check_in_date || ' - ' || b.check_out_date) as dates,
-                           GROUP_CONCAT(DISTINCT g.username) as users
-                    FROM bookings b
-                    JOIN guests g ON b.guest_id = g.id
-                    WHERE b.room_type_id = ? 
-                    AND b.status IN ('pending', 'confirmed')
-                    AND (
-                        (b.check_in_date < ? AND b.check_out_date > ?) OR
-                        (b.check_in_date < ? AND b.check_out_date > ?) OR
-                        (b.check_in_date >= ? AND b.check_out_date <= ?)
-                    )
-                ''', (room_type["id"], check_out_str, check_in_str, 
-                      check_out_str, check_in_str, 
-                      check_in_str, check_out_str))
+                rooms = availability(check_in_str, check_out_str, room_type["capacity"])
+                selected_room = next((r for r in rooms if r["id"] == room_type["id"]), None)
                 
-                booking_conflict = cur.fetchone()
-                conflict_count = booking_conflict["count"] if booking_conflict else 0
-                
-                if conflict_count > 0:
-                    # Получаем информацию о конфликтах
-                    conflict_dates = booking_conflict["dates"] or ""
-                    conflict_users = booking_conflict["users"] or ""
+                if selected_room and selected_room["occupied"]:
+                    dates_list = selected_room["conflict_dates"]
+                    users_list = selected_room["conflict_users"]
                     
                     # Формируем подробное сообщение об ошибке
                     error_msg = f"❌ Номер '{room_type_name}' уже забронирован на выбранные даты!"
                     
-                    if conflict_dates:
-                        dates_list = conflict_dates.split(',')
-                        if dates_list:
-                            error_msg += f" Занятые периоды: {', '.join(dates_list[:3])}"
-                            if len(dates_list) > 3:
-                                error_msg += f" и еще {len(dates_list) - 3} период(ов)"
-                    
-                    if conflict_users:
-                        users_list = conflict_users.split(',')
-                        if users_list:
-                            error_msg += f" (забронировали: {', '.join(users_list[:2])})"
-                            if len(users_list) > 2:
-                                error_msg += f" и еще {len(users_list) - 2} пользователь(ей)"
+                    if dates_list:
+                        error_msg += f" Занятые периоды: {', '.join(dates_list[:3])}"
+                        if len(dates_list) > 3:
+                            error_msg += f" и еще {len(dates_list) - 3} период(ов)"
                     
-                    # Ищем альтернативные номера
-                    cur.execute('''
-                        SELECT * FROM room_types 
-                        WHERE id != ? 
-                        AND capacity >= ?
-                        AND id NOT IN (
-                            SELECT DISTINCT room_type_id 
-                            FROM bookings 
-                            WHERE status IN ('pending', 'confirmed')
-                            AND (
-                                (check_in_date < ? AND check_out_date > ?) OR
-                                (check_in_date < ? AND check_out_date > ?)
-                            )
-                        )
-                        ORDER BY price_per_night
-                        LIMIT 3
-                    ''', (room_type["id"], room_type["capacity"], 
-                          check_out_str, check_in_str, 
-                          check_out_str, check_in_str))
+                    if users_list:
+                        error_msg += f" (забронировали: {', '.join(users_list[:2])})"
+                        if len(users_list) > 2:
+                            error_msg += f" и еще {len(users_list) - 2} пользователь(ей)"
                     
-                    alternatives = cur.fetchall()
+                    # Альтернативы - свободные номера подходящей вместимости
+                    alternatives = [r for r in rooms if r["id"] != room_type["id"] and not r["occupied"]][:3]
                     
                     if alternatives:
                         alt_list = []
@@ -588,35 +3083,13 @@ def booking_process():
                             alt_list.append(f"{alt['name']} - {alt['price_per_night']} руб./ночь")
                         error_msg += f"\n\n✅ Доступные альтернативы:\n" + "\n".join(alt_list)
                     else:
-                        # Ищем любые свободные номера с подходящей вместимостью
-                        cur.execute('''
-                            SELECT * FROM room_types 
-                            WHERE capacity >= ?
-                            ORDER BY price_per_night
-                            LIMIT 3
-                        ''', (room_type["capacity"],))
+                        # Показываем все номера с подходящей вместимостью и их статус
+                        room_list = []
+                        for room in rooms[:3]:
+                            status = "❌ Занят" if room["occupied"] else "✅ Свободен"
+                            room_list.append(f"{room['name']} - {room['price_per_night']} руб. ({status})")
                         
-                        all_rooms = cur.fetchall()
-                        if all_rooms:
-                            room_list = []
-                            for room in all_rooms:
-                                # Проверяем доступность этого номера
-                                cur.execute('''
-                                    SELECT COUNT(*) FROM bookings 
-                                    WHERE room_type_id = ?
-                                    AND status IN ('pending', 'confirmed')
-                                    AND (
-                                        (check_in_date < ? AND check_out_date > ?) OR
-                                        (check_in_date < ? AND check_out_date > ?)
-                                    )
-                                ''', (room['id'], check_out_str, check_in_str, 
-                                      check_out_str, check_in_str))
-                                
-                                is_occupied = cur.fetchone()[0] > 0
-                                status = "❌ Занят" if is_occupied else "✅ Свободен"
-                                
-                                room_list.append(f"{room['name']} - {room['price_per_night']} руб. ({status})")
-                            
+                        if room_list:
                             error_msg += f"\n\n📋 Все номера этой категории:\n" + "\n".join(room_list)
                     
                     flash(error_msg, "error")
@@ -632,13 +3105,9 @@ def booking_process():
                     WHERE guest_id = ?
                     AND room_type_id = ?
                     AND status IN ('pending', 'confirmed')
-                    AND (
-                        (check_in_date < ? AND check_out_date > ?) OR
-                        (check_in_date < ? AND check_out_date > ?)
-                    )
+                    AND check_in_date < ? AND check_out_date > ?
                     LIMIT 1
                 ''', (session["guest_id"], room_type["id"], 
-                      check_out_str, check_in_str, 
                       check_out_str, check_in_str))
                 
                 user_duplicate = cur.fetchone()
@@ -659,13 +3128,9 @@ def booking_process():
                     JOIN room_types rt ON b.room_type_id = rt.id
                     WHERE b.guest_id = ?
                     AND b.status IN ('pending', 'confirmed')
-                    AND (
-                        (b.check_in_date < ? AND b.check_out_date > ?) OR
-                        (b.check_in_date < ? AND b.check_out_date > ?)
-                    )
+                    AND b.check_in_date < ? AND b.check_out_date > ?
                     LIMIT 1
                 ''', (session["guest_id"], 
-                      check_out_str, check_in_str, 
                       check_out_str, check_in_str))
                 
                 any_user_booking = cur.fetchone()
@@ -680,19 +3145,21 @@ def booking_process():
                 nights = (check_out_date - check_in_date).days
                 total_price = room_type["price_per_night"] * nights
                 
-                print(f"Создаю бронирование: {nights} ночей, цена: {total_price} руб.")
-                
-                cur.execute('''
-                    INSERT INTO bookings (guest_id, room_type_id, full_name, passport, phone, 
-                                        check_in_date, check_out_date, total_price, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
-                ''', (session["guest_id"], room_type["id"], full_name, passport, phone, 
-                      check_in_str, check_out_str, total_price))
+                # Проверки выше дают понятные сообщения, но гонку закрывает только
+                # условная вставка: между проверкой и записью номер могли занять
+                booking_id = reserve_booking(conn, session["guest_id"], room_type["id"],
+                                             full_name, passport, phone,
+                                             check_in_str, check_out_str, total_price, nights)
                 
-                booking_id = cur.lastrowid
-                conn.commit()
+                if booking_id is None:
+                    logger.info("Бронирование: конфликт при вставке, номер %r, %s - %s",
+                                room_type_name, check_in_str, check_out_str)
+                    flash(f"❌ Номер '{room_type_name}' только что забронировали на эти даты "
+                          f"или у вас уже есть бронирование на этот период. Выберите другие даты.",
+                          "error")
+                    return render_template("booking_process.html", room_types=room_types)
                 
-                print(f"✅ Бронирование создано! ID: {booking_id}")
+                logger.info("Бронирование: создано id=%s, %s ночей, %.2f руб.", booking_id, nights, total_price)
                 
                 # Формируем подробное сообщение об успехе
                 success_msg = (f"✅ Бронирование №{booking_id} успешно создано!\n"
@@ -706,12 +3173,10 @@ def booking_process():
                 return redirect("/info_booking")
                 
             except ValueError as e:
-                print(f"Ошибка формата даты: {e}")
+                logger.debug("Бронирование: некорректная дата: %s", e)
                 flash("Некорректный формат даты. Используйте формат ГГГГ-ММ-ДД", "error")
             except Exception as e:
-                print(f"Ошибка бронирования: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Ошибка бронирования")
                 if conn:
                     conn.rollback()
                 flash(f"Ошибка при бронировании: {str(e)}", "error")
@@ -719,18 +3184,48 @@ def booking_process():
         return render_template("booking_process.html", room_types=room_types)
         
     except Exception as e:
-        print(f"Ошибка подключения к БД: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Ошибка подключения к БД")
         flash("Ошибка подключения к базе данных", "error")
         return redirect("/")
-    finally:
-        if conn:
-            conn.close()
 
 # ============ ОТЧЕТЫ ============
 
-# ============ ОТЧЕТЫ ============
+# Сколько строк читать из БД за раз при потоковой выгрузке отчетов
+REPORT_CHUNK_SIZE = 500
+
+# Заявки за период: полуинтервал [начало; конец) по самому created_at,
+# без DATE(), чтобы работал индекс idx_bookings_created
+REPORT_BOOKINGS_SQL = '''
+    SELECT b.*, g.username, g.email, g.phone as guest_phone,
+           rt.name as room_type_name, rt.price_per_night
+    FROM bookings b
+    JOIN guests g ON b.guest_id = g.id
+    LEFT JOIN room_types rt ON b.room_type_id = rt.id
+    WHERE b.created_at >= ? AND b.created_at < ?
+    AND b.status IN ('pending', 'confirmed')
+    ORDER BY b.created_at DESC
+'''
+
+# Итоги отчета по тем же заявкам одним агрегатным запросом
+REPORT_BOOKINGS_TOTALS_SQL = '''
+    SELECT COUNT(*) AS total_count,
+           COALESCE(SUM(b.total_price), 0) AS total_price,
+           COALESCE(SUM(b.nights), 0) AS total_nights
+    FROM bookings b
+    JOIN guests g ON b.guest_id = g.id
+    WHERE b.created_at >= ? AND b.created_at < ?
+    AND b.status IN ('pending', 'confirmed')
+'''
+
+def report_period(start, end):
+    """Границы полуинтервала created_at для дат отчета (включительно)"""
+    return (start.isoformat(), (end + timedelta(days=1)).isoformat())
+
+class CsvEcho:
+    """Псевдофайл для csv.writer: writerow возвращает готовую строку CSV"""
+    def write(self, value):
+        return value
+
 
 @app.route("/reports")
 @admin_required
@@ -756,18 +3251,16 @@ def report_free_rooms():
             conn = get_db()
             cur = conn.cursor()
             
-            print(f"📊 Формирую отчет о свободных номерах на {date_str}")
+            logger.info("Отчет о свободных номерах на %s", date_str)
             
             # Получаем все номера
-            cur.execute("SELECT * FROM room_types ORDER BY name")
-            all_rooms = cur.fetchall()
+            all_rooms = sorted(room_catalog.all(), key=lambda room: room['name'])
             
-            # Получаем занятые номера на эту дату
+            # Получаем занятые номера на эту дату из календаря занятости
             cur.execute('''
-                SELECT DISTINCT room_type_id FROM bookings 
-                WHERE status IN ('pending', 'confirmed')
-                AND ? BETWEEN check_in_date AND DATE(check_out_date, '-1 day')
-            ''', (date_str,))
+                SELECT DISTINCT room_type_id FROM room_day_occupancy
+                WHERE day = ?
+            ''', (date.isoformat(),))
             
             occupied_ids = [row[0] for row in cur.fetchall()]
             
@@ -806,9 +3299,7 @@ def report_free_rooms():
             writer.writerow(['Занятых номеров:', occupied_count])
             writer.writerow(['Всего номеров:', len(all_rooms)])
             
-            conn.close()
-            
-            print(f"✅ Отчет сформирован: {free_count} свободных, {occupied_count} занятых")
+            logger.info("Отчет сформирован: %d свободных, %d занятых", free_count, occupied_count)
             
             # Создаем ответ для скачивания
             response = make_response(output.getvalue())
@@ -820,9 +3311,7 @@ def report_free_rooms():
             flash("Некорректный формат даты. Используйте формат ГГГГ-ММ-ДД", "error")
             return redirect("/reports")
         except Exception as e:
-            import traceback
-            print(f"❌ Ошибка формирования отчета: {e}")
-            traceback.print_exc()
+            logger.exception("Ошибка формирования отчета")
             flash(f"Ошибка при формировании отчета: {str(e)}", "error")
             return redirect("/reports")
     
@@ -849,76 +3338,73 @@ def report_bookings():
                 flash("Конечная дата должна быть позже начальной", "error")
                 return redirect("/reports")
             
-            conn = get_db()
-            cur = conn.cursor()
-            
-            print(f"📊 Формирую отчет о бронированиях с {start_date} по {end_date}")
-            
-            cur.execute('''
-                SELECT b.*, g.username, g.email, g.phone as guest_phone,
-                       rt.name as room_type_name, rt.price_per_night
-                FROM bookings b
-                JOIN guests g ON b.guest_id = g.id
-                LEFT JOIN room_types rt ON b.room_type_id = rt.id
-                WHERE DATE(b.created_at) BETWEEN ? AND ?
-                AND b.status IN ('pending', 'confirmed')
-                ORDER BY b.created_at DESC
-            ''', (start_date, end_date))
-            
-            bookings = cur.fetchall()
-            
-            # Формируем отчет
-            output = StringIO()
-            writer = csv.writer(output, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-            
-            # BOM для корректного отображения кириллицы в Excel
-            output.write('\ufeff')
-            
-            writer.writerow(['Отчет о заявках на бронирование', f'Период: {start_date} - {end_date}'])
-            writer.writerow([])
-            writer.writerow(['ID', 'Гость', 'Email гостя', 'Телефон гостя', 
-                           'Тип номера', 'ФИО в заявке', 'Телефон в заявке',
-                           'Паспорт', 'Дата заезда', 'Дата выезда', 'Ночей',
-                           'Цена за ночь', 'Общая стоимость', 'Статус', 'Дата создания'])
-            
-            total_price = 0
-            total_nights = 0
-            
-            for booking in bookings:
-                nights = (datetime.datetime.strptime(booking['check_out_date'], "%Y-%m-%d") - 
-                         datetime.datetime.strptime(booking['check_in_date'], "%Y-%m-%d")).days
-                
-                writer.writerow([
-                    booking['id'],
-                    booking['username'],
-                    booking['email'],
-                    booking['guest_phone'] or '',
-                    booking['room_type_name'] or 'Не указан',
-                    booking['full_name'],
-                    booking['phone'],
-                    booking['passport'] or '',
-                    booking['check_in_date'],
-                    booking['check_out_date'],
-                    nights,
-                    f"{booking['price_per_night']:.2f}" if booking['price_per_night'] else '0.00',
-                    f"{booking['total_price']:.2f}" if booking['total_price'] else '0.00',
-                    booking['status'],
-                    booking['created_at']
-                ])
-                total_price += booking['total_price'] or 0
-                total_nights += nights
-            
-            writer.writerow([])
-            writer.writerow(['ИТОГО:'])
-            writer.writerow(['Всего заявок:', len(bookings)])
-            writer.writerow(['Общая стоимость:', f"{total_price:.2f} руб."])
-            writer.writerow(['Общее количество ночей:', total_nights])
-            
-            conn.close()
-            
-            print(f"✅ Отчет сформирован: {len(bookings)} бронирований, {total_price:.2f} руб.")
+            logger.info("Отчет о бронированиях с %s по %s", start_date, end_date)
+
+            period = report_period(start, end)
+
+            def generate():
+                # Соединение из g.db вернется в пул сразу после выхода из представления,
+                # поэтому поток отчета берет собственное и держит его до конца выгрузки
+                conn = db_pool.acquire()
+                try:
+                    cur = conn.cursor()
+                    cur.execute(REPORT_BOOKINGS_SQL, period)
+                    
+                    writer = csv.writer(CsvEcho(), delimiter=',', quoting=csv.QUOTE_MINIMAL)
+                    
+                    # BOM для корректного отображения кириллицы в Excel
+                    yield '\ufeff'
+                    
+                    yield writer.writerow(['Отчет о заявках на бронирование', f'Период: {start_date} - {end_date}'])
+                    yield writer.writerow([])
+                    yield writer.writerow(['ID', 'Гость', 'Email гостя', 'Телефон гостя', 
+                                           'Тип номера', 'ФИО в заявке', 'Телефон в заявке',
+                                           'Паспорт', 'Дата заезда', 'Дата выезда', 'Ночей',
+                                           'Цена за ночь', 'Общая стоимость', 'Статус', 'Дата создания'])
+                    
+                    while True:
+                        bookings = cur.fetchmany(REPORT_CHUNK_SIZE)
+                        if not bookings:
+                            break
+                    
+                        chunk = []
+                        for booking in bookings:
+                            chunk.append(writer.writerow([
+                                booking['id'],
+                                booking['username'],
+                                booking['email'],
+                                booking['guest_phone'] or '',
+                                booking['room_type_name'] or 'Не указан',
+                                booking['full_name'],
+                                booking['phone'],
+                                booking['passport'] or '',
+                                booking['check_in_date'],
+                                booking['check_out_date'],
+                                booking['nights'],
+                                f"{booking['price_per_night']:.2f}" if booking['price_per_night'] else '0.00',
+                                f"{booking['total_price']:.2f}" if booking['total_price'] else '0.00',
+                                booking['status'],
+                                booking['created_at']
+                            ]))
+                        yield ''.join(chunk)
+                    
+                    totals = conn.execute(REPORT_BOOKINGS_TOTALS_SQL, period).fetchone()
+                    total_count = totals['total_count']
+                    total_price = totals['total_price']
+                    total_nights = totals['total_nights']
+                    
+                    yield writer.writerow([])
+                    yield writer.writerow(['ИТОГО:'])
+                    yield writer.writerow(['Всего заявок:', total_count])
+                    yield writer.writerow(['Общая стоимость:', f"{total_price:.2f} руб."])
+                    yield writer.writerow(['Общее количество ночей:', total_nights])
+                    
+                    logger.info("Отчет сформирован: %d бронирований, %.2f руб.", total_count, total_price)
+                finally:
+                    db_pool.release(conn)
             
-            response = make_response(output.getvalue())
+            # Отчет отдается потоком: строки пишутся по мере чтения из БД
+            response = Response(stream_with_context(generate()))
             response.headers["Content-Disposition"] = f"attachment; filename=bookings_{start_date}_{end_date}.csv"
             response.headers["Content-type"] = "text/csv; charset=utf-8-sig"
             return response
@@ -927,17 +3413,46 @@ def report_bookings():
             flash("Некорректный формат даты. Используйте формат ГГГГ-ММ-ДД", "error")
             return redirect("/reports")
         except Exception as e:
-            import traceback
-            print(f"❌ Ошибка формирования отчета: {e}")
-            traceback.print_exc()
+            logger.exception("Ошибка формирования отчета")
             flash(f"Ошибка при формировании отчета: {str(e)}", "error")
             return redirect("/reports")
     
     return redirect("/reports")
 
+# Запросы отчетов, которые не должны читать bookings полным сканированием
+QUERY_PLAN_GUARDS = [
+    ("report_bookings", REPORT_BOOKINGS_SQL, ("2000-01-01", "2000-01-02")),
+    ("report_bookings_totals", REPORT_BOOKINGS_TOTALS_SQL, ("2000-01-01", "2000-01-02")),
+]
+
+def find_full_scans(cur, sql, params):
+    """Шаги плана запроса (EXPLAIN QUERY PLAN) с полным сканированием таблицы"""
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row["detail"] for row in cur.fetchall() if row["detail"].startswith("SCAN ")]
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Проверить, что запросы отчетов используют индексы"""
+    conn = db_pool.acquire()
+    try:
+        cur = conn.cursor()
+        failed = False
+        for name, sql, params in QUERY_PLAN_GUARDS:
+            scans = find_full_scans(cur, sql, params)
+            if scans:
+                failed = True
+                print(f"❌ {name}: полное сканирование - {'; '.join(scans)}")
+            else:
+                print(f"✅ {name}: индекс используется")
+    finally:
+        db_pool.release(conn)
+    if failed:
+        raise SystemExit(1)
+
 # ============ ОТЗЫВЫ ============
 
 @app.route("/reviews", methods=["GET", "POST"])
+@cached_page
 def reviews():
     """Страница с отзывами"""
     if request.method == "POST":
@@ -969,63 +3484,55 @@ def reviews():
             )
             
             conn.commit()
+            page_cache.invalidate(url_for("reviews"))
             flash("Спасибо за ваш отзыв! Он успешно сохранен.", "success")
             
         except ValueError:
             flash("Некорректный рейтинг", "error")
         except Exception as e:
-            print(f"Ошибка при сохранении отзыва: {str(e)}")
+            logger.exception("Ошибка при сохранении отзыва")
             if conn:
                 conn.rollback()
             flash(f"Ошибка при сохранении отзыва: {str(e)}", "error")
-        finally:
-            if conn:
-                conn.close()
         
         # ВСЕГДА возвращаем на страницу отзывов
         return redirect("/reviews")
     
-    # GET запрос - показываем все отзывы
+    # GET запрос - показываем отзывы постранично
     conn = None
     try:
         conn = get_db()
         cur = conn.cursor()
         
-        cur.execute('''
-            SELECT r.*, g.username 
-            FROM reviews r 
-            JOIN guests g ON r.guest_id = g.id 
-            ORDER BY r.created_at DESC
-        ''')
-        
-        reviews_list = cur.fetchall()
+        reviews_list, next_cursor = fetch_reviews_page(decode_cursor(request.args.get("before")))
         
-        # Получаем статистику
+        # Получаем статистику из сводной строки review_stats
         cur.execute('''
             SELECT 
-                AVG(rating) as avg_rating,
-                COUNT(*) as total_reviews,
-                COUNT(CASE WHEN rating = 5 THEN 1 END) as five_stars,
-                COUNT(CASE WHEN rating = 4 THEN 1 END) as four_stars,
-                COUNT(CASE WHEN rating = 3 THEN 1 END) as three_stars,
-                COUNT(CASE WHEN rating = 2 THEN 1 END) as two_stars,
-                COUNT(CASE WHEN rating = 1 THEN 1 END) as one_stars
-            FROM reviews
+                CASE WHEN five_stars + four_stars + three_stars + two_stars + one_stars > 0
+                     THEN rating_sum * 1.0 / (five_stars + four_stars + three_stars + two_stars + one_stars)
+                END as avg_rating,
+                total_reviews,
+                five_stars,
+                four_stars,
+                three_stars,
+                two_stars,
+                one_stars
+            FROM review_stats
+            WHERE id = 1
         ''')
         
         stats = cur.fetchone()
         
         return render_template("reviews.html", 
                              reviews=reviews_list, 
-                             stats=stats)
+                             stats=stats,
+                             next_cursor=next_cursor)
         
     except Exception as e:
-        print(f"Ошибка работы с отзывами: {e}")
+        logger.exception("Ошибка работы с отзывами")
         flash("Ошибка при загрузке отзывов", "error")
         return redirect("/")
-    finally:
-        if conn:
-            conn.close()
 
 # ============ ОСТАЛЬНЫЕ СТРАНИЦЫ ============
 
@@ -1033,91 +3540,73 @@ def reviews():
 @login_required
 def info_booking():
     """Страница с информацией о бронированиях"""
-    conn = None
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        
-        cur.execute('''
-            SELECT b.*, rt.name as room_type_name, rt.price_per_night
-            FROM bookings b
-            LEFT JOIN room_types rt ON b.room_type_id = rt.id
-            WHERE b.guest_id = ?
-            ORDER BY b.created_at DESC
-        ''', (session["guest_id"],))
-        
-        bookings = cur.fetchall()
-        return render_template("info_booking.html", bookings=bookings)
+        bookings, next_cursor = fetch_guest_bookings_page(
+            session["guest_id"], decode_cursor(request.args.get("before"))
+        )
+        return render_template("info_booking.html", bookings=bookings, next_cursor=next_cursor)
         
     except Exception as e:
-        print(f"Ошибка получения бронирований: {e}")
+        logger.exception("Ошибка получения бронирований")
         flash("Ошибка при получении информации о бронированиях", "error")
         return redirect("/")
-    finally:
-        if conn:
-            conn.close()
+
+@app.route("/api/reviews")
+def api_reviews():
+    """Следующая страница отзывов в JSON (для кнопки «Показать еще»)"""
+    rows, next_cursor = fetch_reviews_page(decode_cursor(request.args.get("before")))
+    return jsonify(items=[dict(row) for row in rows], next_cursor=next_cursor)
+
+@app.route("/api/info_booking")
+@login_required
+def api_info_booking():
+    """Следующая страница бронирований гостя в JSON"""
+    rows, next_cursor = fetch_guest_bookings_page(
+        session["guest_id"], decode_cursor(request.args.get("before"))
+    )
+    return jsonify(items=[dict(row) for row in rows], next_cursor=next_cursor)
 
 @app.route("/info_o_nas")
+@cached_page
 def info_o_nas():
     """Страница 'О нас'"""
     return render_template("info_o_nas.html")
 
 @app.route("/ekonom_room")
+@cached_page
 def ekonom_room():
     """Страница с информацией об экономных номерах"""
-    conn = None
-    try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM room_types WHERE name LIKE '%Эконом%'")
-        room = cur.fetchone()
-        
-        if not room:
-            flash("Информация о номерах временно недоступна", "error")
-            return redirect("/")
-        
-        return render_template("ekonom_room.html", room=room)
-    finally:
-        if conn:
-            conn.close()
+    room = room_catalog.find("Эконом")
+    
+    if not room:
+        flash("Информация о номерах временно недоступна", "error")
+        return redirect("/")
+    
+    return render_template("ekonom_room.html", room=room)
 
 @app.route("/standart_room")
+@cached_page
 def standart_room():
     """Страница с информацией о стандартных номерах"""
-    conn = None
-    try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM room_types WHERE name LIKE '%Стандарт%'")
-        room = cur.fetchone()
-        
-        if not room:
-            flash("Информация о номерах временно недоступна", "error")
-            return redirect("/")
-        
-        return render_template("standart_room.html", room=room)
-    finally:
-        if conn:
-            conn.close()
+    room = room_catalog.find("Стандарт")
+    
+    if not room:
+        flash("Информация о номерах временно недоступна", "error")
+        return redirect("/")
+    
+    return render_template("standart_room.html", room=room)
 
 @app.route("/lux_room")
+@cached_page
 def lux_room():
     """Страница с информацией о люксовых номерах"""
-    conn = None
-    try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM room_types WHERE name LIKE '%Люкс%'")
-        room = cur.fetchone()
-        
-        if not room:
-            flash("Информация о номерах временно недоступна", "error")
-            return redirect("/")
-        
-        return render_template("lux_room.html", room=room)
-    finally:
-        if conn:
-            conn.close()
+    room = room_catalog.find("Люкс")
+    
+    if not room:
+        flash("Информация о номерах временно недоступна", "error")
+        return redirect("/")
+    
+    return render_template("lux_room.html", room=room)
 
 @app.route("/admin_login_page", methods=["GET", "POST"])
 def admin_login_page():
@@ -1140,9 +3629,12 @@ def admin_login_page():
             
             if not admin:
                 flash("Администратор не найден", "error")
-            elif admin["password_hash"] != hash_password(password):
+            elif not check_password(password, admin["password_hash"]):
                 flash("Неверный пароль", "error")
             else:
+                if needs_rehash(admin["password_hash"]):
+                    upgrade_password_hash(cur, "admins", admin["id"], password)
+                    conn.commit()
                 session["admin_id"] = admin["id"]
                 session["admin_username"] = admin["username"]
                 session["admin_name"] = admin["full_name"]
@@ -1150,11 +3642,8 @@ def admin_login_page():
                 return redirect("/basa_dannix")
                 
         except Exception as e:
-            print(f"Ошибка авторизации админа: {str(e)}")
+            logger.exception("Ошибка авторизации админа")
             flash(f"Ошибка при авторизации: {str(e)}", "error")
-        finally:
-            if conn:
-                conn.close()
     
     return render_template("avtorizacia_admin.html")
 
@@ -1162,80 +3651,23 @@ def admin_login_page():
 @app.route("/basa_dannix")
 def basa_dannix():
     """Панель администратора"""
-    print("=== ДЕБАГ АДМИН-ПАНЕЛИ ===")
-    print(f"Сессия: {session}")
-    print(f"admin_id в сессии: {'admin_id' in session}")
-    
     if "admin_id" not in session:
-        print("❌ Администратор не авторизован")
+        logger.info("Панель администратора: нет авторизации")
         flash("Требуется авторизация администратора", "error")
         return redirect("/admin_login_page")
     
-    print(f"✅ Администратор авторизован: ID={session.get('admin_id')}")
+    logger.debug("Панель администратора: admin_id=%s", session.get("admin_id"))
     
-    conn = None
     try:
-        print("Подключаюсь к БД...")
-        conn = get_db()
-        cur = conn.cursor()
-        
-        print("Получаю статистику...")
-        cur.execute("SELECT COUNT(*) FROM guests")
-        total_guests = cur.fetchone()[0]
-        print(f"Всего гостей: {total_guests}")
-        
-        cur.execute("SELECT COUNT(*) FROM bookings")
-        total_bookings = cur.fetchone()[0]
-        print(f"Всего бронирований: {total_bookings}")
-        
-        cur.execute("SELECT COUNT(*) FROM bookings WHERE status = 'pending'")
-        pending_bookings = cur.fetchone()[0]
-        print(f"Ожидающих: {pending_bookings}")
-        
-        cur.execute("SELECT COUNT(*) FROM reviews")
-        total_reviews = cur.fetchone()[0]
-        print(f"Всего отзывов: {total_reviews}")
-        
-        print("Получаю последних гостей...")
-        cur.execute("SELECT * FROM guests ORDER BY created_at DESC LIMIT 10")
-        recent_guests = cur.fetchall()
-        
-        print("Получаю последние бронирования...")
-        cur.execute('''
-            SELECT b.*, g.username, rt.name as room_type_name
-            FROM bookings b
-            JOIN guests g ON b.guest_id = g.id
-            LEFT JOIN room_types rt ON b.room_type_id = rt.id
-            ORDER BY b.created_at DESC LIMIT 10
-        ''')
-        recent_bookings = cur.fetchall()
-        
-        print("Получаю последние отзывы...")
-        cur.execute('''
-            SELECT r.*, g.username
-            FROM reviews r
-            JOIN guests g ON r.guest_id = g.id
-            ORDER BY r.created_at DESC LIMIT 10
-        ''')
-        recent_reviews = cur.fetchall()
+        snapshot = dashboard.get()
+        logger.debug("Панель администратора: гостей %s, бронирований %s, ожидающих %s, отзывов %s",
+                     snapshot["total_guests"], snapshot["total_bookings"],
+                     snapshot["pending_bookings"], snapshot["total_reviews"])
         
-        print("✅ Все данные получены, рендерю шаблон...")
-        
-        return render_template(
-            "basa_dannix.html",
-            total_guests=total_guests,
-            total_bookings=total_bookings,
-            pending_bookings=pending_bookings,
-            total_reviews=total_reviews,
-            recent_guests=recent_guests,
-            recent_bookings=recent_bookings,
-            recent_reviews=recent_reviews
-        )
+        return render_template("basa_dannix.html", **snapshot)
         
     except Exception as e:
-        import traceback
-        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА В АДМИН-ПАНЕЛИ: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Ошибка в панели администратора")
         flash(f"Ошибка при загрузке данных: {str(e)}", "error")
         # НЕ редиректим на главную, а показываем хотя бы пустую админку
         return render_template(
@@ -1248,9 +3680,6 @@ def basa_dannix():
             recent_bookings=[],
             recent_reviews=[]
         )
-    finally:
-        if conn:
-            conn.close()
 
 
 @app.route("/logout")
@@ -1271,29 +3700,119 @@ def admin_logout():
     flash("Вы вышли из системы администратора", "info")
     return redirect("/")
 
+@app.route("/admin/db_stats")
+@admin_required
+def admin_db_stats():
+    """Статистика пула соединений с БД и отложенной записи"""
+    stats = db_pool.stats()
+    stats["write_behind"] = write_behind.stats()
+    return jsonify(stats)
+
+@app.route("/metrics")
+@admin_required
+def metrics():
+    """Метрики приложения в формате Prometheus"""
+    return Response(request_metrics.render(db_pool.stats()),
+                    mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/slow_queries")
+@admin_required
+def admin_slow_queries():
+    """Журнал медленных запросов: ?endpoint=, ?min_ms=, ?full_scan=1, ?limit="""
+    full_scan = request.args.get("full_scan")
+    try:
+        min_ms = float(request.args.get("min_ms", 0))
+        limit = min(int(request.args.get("limit", 100)), SLOW_QUERY_LOG_SIZE)
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры"}), 400
+    return jsonify({
+        "threshold_ms": SLOW_QUERY_MS,
+        "queries": slow_query_log.entries(
+            endpoint=request.args.get("endpoint"),
+            min_ms=min_ms,
+            full_scan=None if full_scan is None else full_scan in ("1", "true"),
+            limit=limit,
+        ),
+    })
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
 # ============ ЗАПУСК ПРИЛОЖЕНИЯ ============
 
+# Бюджет на create_app() без учета импорта модулей (мс), проверяется bench-startup
+STARTUP_BUDGET_MS = 50
+_app_ready = False
+
+
+def create_app(config=None):
+    """Фабрика приложения для WSGI-сервера: gunicorn "app:create_app()".
+
+    Старт процесса не делает блокирующей работы: схема проверяется одним
+    чтением PRAGMA user_version (DDL - только если версия устарела),
+    справочники, манифест статики и соединения поднимаются лениво.
+    """
+    global _app_ready
+    if config:
+        app.config.update(config)
+    if not _app_ready:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        migrate_db()
+        _app_ready = True
+    return app
+
+
+@app.cli.command("create-missing-images")
+def create_missing_images_command():
+    """Создать пустые файлы-заглушки для отсутствующих изображений"""
+    create_missing_images()
+
+
+@app.cli.command("checkpoint-db")
+def checkpoint_db_command():
+    """Перенести WAL в основной файл БД (вместо удаления -wal/-shm)"""
+    result = checkpoint_db()
+    status = "⚠️ БД занята, перенесено частично" if result["busy"] else "✅ WAL перенесен"
+    print(f"{status}: страниц в журнале {result['log_pages']}, перенесено {result['checkpointed']}")
+
+
+@app.cli.command("bench-startup")
+@click.option("--runs", default=5, help="Число холодных запусков")
+@click.option("--max-ms", default=STARTUP_BUDGET_MS, type=float,
+              help="Допустимая медиана create_app() в мс (иначе код выхода 1)")
+def bench_startup_command(runs, max_ms):
+    """Время холодного старта: импорт модуля и create_app() в новом процессе"""
+    code = ("import time; t0 = time.perf_counter(); import app; t1 = time.perf_counter(); "
+            "app.create_app(); t2 = time.perf_counter(); "
+            "print(f'{(t1 - t0) * 1000:.3f} {(t2 - t1) * 1000:.3f}')")
+    imports, factories = [], []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR,
+                                capture_output=True, text=True, check=True)
+        import_ms, factory_ms = map(float, result.stdout.strip().splitlines()[-1].split())
+        imports.append(import_ms)
+        factories.append(factory_ms)
+    imports.sort()
+    factories.sort()
+    import_median = imports[len(imports) // 2]
+    factory_median = factories[len(factories) // 2]
+    print(f"📊 Холодный старт ({runs} запусков): импорт {import_median:.1f} мс, "
+          f"create_app() {factory_median:.1f} мс (макс. {factories[-1]:.1f} мс)")
+    if factory_median > max_ms:
+        print(f"❌ create_app() дольше бюджета {max_ms:.0f} мс")
+        raise SystemExit(1)
+    print(f"✅ В пределах бюджета {max_ms:.0f} мс")
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("🚀 ЗАПУСК ГОСТИНИЦЫ L&N")
     print("=" * 60)
     
-    cleanup_locks()
-    
-    os.makedirs('templates', exist_ok=True)
-    os.makedirs('static/images', exist_ok=True)
-    os.makedirs('data', exist_ok=True)
-    
-    create_missing_images()
-    
-    time.sleep(1)
-    
     try:
         init_db()
+        create_app()
     except Exception as e:
         print(f"⚠️ Ошибка инициализации БД: {e}")
     